@@ -0,0 +1,69 @@
+"""
+Times ``keyboard.key.load_assets`` for the keys of a whole board, the way ``Keyboard.update_cells`` calls it:
+without an executor (on the main thread) and with ``manager.get_executor()`` at several ``decode_threads`` values.
+
+Run from the repository root::
+
+    python benchmarks/asset_decoding.py [keyboard name] [repeats] [decode_threads ...]
+
+This opens the main window, like importing the ``keyboard`` package always does.
+The caches are emptied and the disk cache is turned off between repeats, so every run decodes every asset again.
+Note that ``get_executor`` never uses more threads than there are CPU cores.
+"""
+import os
+import sys
+from importlib import import_module
+from itertools import chain
+from timeit import timeit
+
+from PIL import Image
+
+sys.path.append(os.path.abspath(os.getcwd()))
+
+from keyboard import manager  # noqa: E402
+from keyboard.cache import asset_cache, disk_cache  # noqa: E402
+from keyboard.key import load_assets, unprocessed  # noqa: E402
+
+
+def board_keys(name: str, size: int) -> list[tuple]:
+    module = import_module(f'keyboards.{name}')
+    folder = getattr(module, 'asset_folder', name)
+    return [(key_name, folder, size, Image.BILINEAR)
+            for key_name in chain.from_iterable(chain.from_iterable(module.layouts.values()))]
+
+
+def load_board(keys: list[tuple], executor) -> list[bytes]:
+    asset_cache.clear()
+    return [asset.render(unprocessed).tobytes() for asset in load_assets(keys, unprocessed, executor)]
+
+
+def main() -> None:
+    name = sys.argv[1] if len(sys.argv) > 1 else 'lat'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    thread_counts = [int(arg) for arg in sys.argv[3:]] or [2, 4, 8]
+    keys = board_keys(name, 80)  # key_size * pressed_key_scale with the default settings
+    disk_limit, decode_threads = disk_cache.limit, manager.decode_threads
+    disk_cache.limit = 0
+    try:
+        serial = load_board(keys, None)
+        print(f'{name}: {len(keys)} keys, {os.cpu_count()} CPU cores, {repeats} repeats')
+        seconds = timeit(lambda: load_board(keys, None), number=repeats) / repeats
+        print(f'{"no executor":>18}: {seconds * 1000:8.2f} ms per board')
+        for threads in thread_counts:
+            manager.decode_threads = threads
+            manager.executor = None
+            executor = manager.get_executor()
+            # sanity check: the result has to be the same with or without an executor
+            assert load_board(keys, executor) == serial
+            seconds = timeit(lambda: load_board(keys, executor), number=repeats) / repeats
+            used = 'no executor' if executor is None else f'{min(threads, os.cpu_count())} threads'
+            print(f'{f"decode_threads={threads}":>18}: {seconds * 1000:8.2f} ms per board ({used})')
+            if executor is not None:
+                executor.shutdown()
+    finally:
+        disk_cache.limit, manager.decode_threads = disk_limit, decode_threads
+        manager.executor = None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Compares the per-pixel gradient renderer (``effects.gradient.degrees_gradient``) against ``render_gradient``,
+which ``gradient_image`` and therefore ``gradient_overlay``, ``gradient_background`` and ``pride`` use,
+at a few message sizes and angles, and checks that both give the same colors within one color level.
+
+Run from the repository root::
+
+    python benchmarks/gradient.py [repeats]
+
+The per-pixel renderer is only run once per case, since it takes seconds for the larger sizes.
+"""
+import os
+import sys
+from timeit import timeit
+
+from PIL import Image, ImageChops
+
+sys.path.append(os.path.abspath(os.getcwd()))
+
+from effects.gradient import Rect, degrees_gradient, gradient_color, render_gradient  # noqa: E402
+from effects.pride import colors as pride  # noqa: E402
+
+rainbow = [(255, 128, 128), (128, 255, 128), (128, 128, 255), (255, 128, 128)]
+SIZES = [(200, 64), (800, 200), (2000, 200)]
+ANGLES = [0, 30, 45, 90, 135]
+
+
+def per_pixel_gradient(width: int, height: int, color_palette: list, degrees: float) -> Image.Image:
+    # what gradient_image did before render_gradient
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    degrees_gradient(image, Rect(0, 0, width - 1, height - 1), gradient_color, color_palette, -degrees)
+    return image
+
+
+def main() -> None:
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print(f'{"palette":>8} {"size":>9} {"angle":>5} {"per pixel":>12} {"render":>10} {"max diff":>8}')
+    for name, palette in (('rainbow', rainbow), ('pride', pride)):
+        for width, height in SIZES:
+            for angle in ANGLES:
+                args = (width, height, palette, angle)
+                old_seconds = timeit(lambda: per_pixel_gradient(*args), number=1)
+                new_seconds = timeit(lambda: render_gradient(width, height, palette, -angle), number=repeats) / repeats
+                new_image = render_gradient(width, height, palette, -angle)
+                difference = ImageChops.difference(per_pixel_gradient(*args), new_image)
+                max_difference = max(high for low, high in difference.getextrema())
+                assert max_difference <= 1, f'{name} {width}x{height} at {angle} degrees is off by {max_difference}'
+                print(f'{name:>8} {f"{width}x{height}":>9} {angle:>5} {old_seconds * 1000:9.1f} ms '
+                      f'{new_seconds * 1000:7.2f} ms {max_difference:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compares the per-key cost of turning a rendered key image into pyglet image data:
+the old PNG round-trip (encode to ``BytesIO``, decode with ``pyglet.image.load``) against ``to_image_data``.
+
+Run from the repository root::
+
+    python benchmarks/key_texture.py [keyboard name] [repeats]
+
+This opens the main window, like importing the ``keyboard`` package always does.
+Texture upload (which costs the same for both paths) isn't included.
+"""
+import os
+import sys
+from importlib import import_module
+from io import BytesIO
+from itertools import chain
+from timeit import timeit
+
+from PIL import Image
+from pyglet.image import ImageData, load
+
+sys.path.append(os.path.abspath(os.getcwd()))
+
+from keyboard.key import to_image_data  # noqa: E402
+
+
+def png_round_trip(image: Image.Image) -> ImageData:
+    data_buffer = BytesIO()
+    image.save(data_buffer, format='png')
+    data_buffer.seek(0)
+    return load('temp.png', file=data_buffer)
+
+
+def key_images(name: str, size: int) -> list[Image.Image]:
+    module = import_module(f'keyboards.{name}')
+    folder = getattr(module, 'asset_folder', name)
+    images = []
+    for key_name in chain.from_iterable(chain.from_iterable(module.layouts.values())):
+        path = f'keyboards/assets/{folder}/{key_name}.png'
+        if not os.path.isfile(path):
+            path = 'keyboards/assets/util/none.png'
+        image = Image.open(path).convert('RGBA')
+        images.append(image.resize((round(size / image.height * image.width), size), resample=Image.BILINEAR))
+    return images
+
+
+def main() -> None:
+    name = sys.argv[1] if len(sys.argv) > 1 else 'lat'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    images = key_images(name, 80)  # key_size * pressed_key_scale with the default settings
+    # sanity check: both paths have to produce the same pixels
+    for image in images:
+        old, new = png_round_trip(image), to_image_data(image)
+        assert old.get_data('RGBA', image.width * 4) == new.get_data('RGBA', image.width * 4)
+    print(f'{name}: {len(images)} keys, {repeats} repeats')
+    for label, func in (('png round-trip', png_round_trip), ('to_image_data', to_image_data)):
+        seconds = timeit(lambda: [func(image) for image in images], number=repeats) / repeats
+        print(f'{label:>16}: {seconds * 1000:8.2f} ms per board, {seconds / len(images) * 1e6:8.1f} us per key')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+An optional single-file bundle of the key assets, so that the keyboard doesn't have to look for, open and decode
+hundreds of small PNG files on every start.
+
+The bundle is built from the asset tree by running this module from the repository root::
+
+    python bundle.py [--compress]
+
+It has to be built again after the assets are edited; until then, the keyboard keeps using the bundled versions.
+Assets that aren't in the bundle (or everything, if there's no bundle) are read from the loose files as usual.
+
+Bundle layout: a header (magic, index length), a JSON index, then the pixel data of every asset
+(with offsets in the index counted from the end of the index).
+The pixel data is stored decoded, in the mode of the original file, and optionally zlib-compressed.
+Uncompressed bundles are memory-mapped and read in place, so several running instances share the same pages.
+"""
+import json
+import mmap
+import os
+import sys
+import zlib
+from struct import Struct
+from typing import Optional
+
+from PIL import Image
+
+BUNDLE_PATH = 'keyboards/assets.bundle'
+ASSET_FOLDER = 'keyboards/assets'
+
+
+class AssetBundle:
+    """
+    A memory-mapped asset bundle.
+
+    You should not directly instantiate the class, instead you do::
+
+        from bundle import asset_bundle
+
+    to access the bundle shared by all keys.
+    """
+
+    header = Struct('<4sI')
+    magic = b'QKB1'
+
+    def __init__(self, path: str = BUNDLE_PATH) -> None:
+        """
+        Opens the bundle at ``path`` if there is one.
+
+        :param path: The bundle path.
+        """
+        self.path = path
+        self.mtime = None
+        self.data = None
+        self.data_start = 0
+        self.assets = dict()
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Opens the bundle again if it was created, rebuilt or removed since it was last opened.
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        # images loaded earlier may still point into the old mapping, so it's left for the garbage collector to close
+        self.mtime, self.data, self.assets = mtime, None, dict()
+        if mtime is None:
+            return
+        try:
+            with open(self.path, 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, index_length = self.header.unpack_from(data)
+            if magic != self.magic:
+                raise ValueError(f'{self.path} is not an asset bundle')
+            index = json.loads(bytes(data[self.header.size:self.header.size + index_length]).decode('utf-8'))
+        except (OSError, ValueError):
+            print(f'Could not read {self.path}, using the loose asset files instead.', file=sys.stderr)
+            return
+        self.data = data
+        self.data_start = self.header.size + index_length
+        self.assets = index
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.assets
+
+    def get_mtime(self, path: str) -> Optional[float]:
+        """
+        Get the modification time the asset file had when it was bundled.
+
+        :param path: The asset path, e.g. ``keyboards/assets/util/none.png``.
+        :return: The modification time, or None if the asset isn't bundled.
+        """
+        entry = self.assets.get(path, None)
+        return None if entry is None else entry['mtime']
+
+    def open(self, path: str) -> Optional[Image.Image]:
+        """
+        Get a bundled asset. The result is the same as ``Image.open(path)`` on the original file,
+        except that it may share memory with the bundle and therefore should not be modified in place.
+
+        :param path: The asset path, e.g. ``keyboards/assets/util/none.png``.
+        :return: The asset image, or None if the asset isn't bundled.
+        """
+        entry = self.assets.get(path, None)
+        if entry is None:
+            return None
+        mode, size = entry['mode'], tuple(entry['size'])
+        offset = self.data_start + entry['offset']
+        buffer = memoryview(self.data)[offset:offset + entry['length']]
+        if entry['compressed']:
+            image = Image.frombytes(mode, size, zlib.decompress(buffer))
+        else:
+            image = Image.frombuffer(mode, size, buffer, 'raw', mode, 0, 1)
+        if 'palette' in entry:
+            image.putpalette(bytes.fromhex(entry['palette']), entry['palette_mode'])
+        if 'transparency' in entry:
+            transparency = entry['transparency']
+            image.info['transparency'] = bytes(transparency) if type(transparency) is list else transparency
+        return image
+
+
+def build(path: str = BUNDLE_PATH, folder: str = ASSET_FOLDER, compress: bool = False) -> int:
+    """
+    Builds an asset bundle from every PNG file in ``folder`` and its subfolders.
+
+    :param path: The bundle path.
+    :param folder: The asset folder.
+    :param compress: Whether to zlib-compress the pixel data. Compressed bundles are smaller,
+                     but have to be decompressed by every running instance on its own.
+    :return: The number of bundled assets.
+    """
+    index, chunks, offset = dict(), [], 0
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for file in sorted(files):
+            if not file.endswith('.png'):
+                continue
+            file_path = os.path.join(root, file)
+            image = Image.open(file_path)
+            image.load()
+            data = image.tobytes()
+            if compress:
+                data = zlib.compress(data)
+            entry = {
+                'offset': offset, 'length': len(data), 'size': image.size, 'mode': image.mode,
+                'compressed': compress, 'mtime': os.path.getmtime(file_path),
+            }
+            if image.mode == 'P':
+                palette_mode, palette = image.palette.getdata()
+                entry['palette'], entry['palette_mode'] = palette.hex(), palette_mode
+            if 'transparency' in image.info:
+                transparency = image.info['transparency']
+                entry['transparency'] = list(transparency) if type(transparency) is bytes else transparency
+            index[file_path.replace(os.sep, '/')] = entry
+            chunks.append(data)
+            offset += len(data)
+    index_data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(AssetBundle.header.pack(AssetBundle.magic, len(index_data)))
+        file.write(index_data)
+        for data in chunks:
+            file.write(data)
+    # running instances keep their mapping of the old bundle, though Windows doesn't allow replacing it at all
+    os.replace(temp_path, path)
+    return len(index)
+
+
+"""The singleton; check ``bundle.AssetBundle`` for details on usage."""
+asset_bundle = AssetBundle()
+
+
+if __name__ == '__main__':
+    count = build(compress='--compress' in sys.argv[1:])
+    print(f'Bundled {count} assets into {BUNDLE_PATH} ({os.path.getsize(BUNDLE_PATH) / 1024 / 1024:.1f} MB).')
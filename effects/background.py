@@ -5,6 +5,10 @@ from PIL import Image
 color = (34, 34, 34)
 
 
+def describe() -> list[tuple]:
+    return [('background', color)]  # see keyboard.pipeline
+
+
 def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
     if image is None:
         return
@@ -10,47 +10,79 @@ overlay_color = ['0', '50.0', '100.0']
 char_scale = 1.5
 
 
-def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
-    keyboard = manager.keyboard
+def get_overlay(keyboard) -> Optional[tuple[tuple[int, int, int], Optional[int]]]:
+    """
+    Works out how the current key should be recolored, without picking a color.
+
+    :return: None if the key should be left as is, otherwise a tuple of the overlay color and the divisor for
+             how much the key should be expanded to highlight a color picker key (None for no expansion).
+    """
     if 'words' in keyboard.name or 'words' in keyboard.current_key.name:
-        return image
+        return None
     if keyboard.current_key.name in (keyboard.backspace_key, keyboard.enter_key):
-        return image
-    global overlay_color
+        return None
     color = overlay_color.copy()
+    expand = None
     if keyboard.name == 'color_picker':
         key = keyboard.current_key.name.split(':')
-        if len(key) == 2 and key[0] == 'cell':
-            key_value = key[1]
-            if keyboard.current_key_is_pressed:
-                parts = key_value.split(',')
-                changed = False
-                for part in parts:
-                    part = part.strip()
-                    current_part = 'hsv'.find(part[0])
-                    if current_part != -1:
-                        overlay_color[current_part] = part[1:]
-                        changed = True
-                return None if changed else image
-            else:
-                parts = key_value.split(',')
-                found = False
-                changed = False
-                for part in parts:
-                    part = part.strip()
-                    current_part = 'hsv'.find(part[0])
-                    if current_part != -1:
-                        changed = changed or color[current_part] != part[1:]
-                        found = True
-                    color[current_part] = part[1:]
-                if not found:
-                    return image
-                if changed:
-                    image = ImageOps.expand(image, round(image.width * (char_scale - 1)))
-                else:
-                    image = ImageOps.expand(image, round(image.width * (char_scale - 1) / 3))
+        if len(key) == 2 and key[0] == 'cell' and not keyboard.current_key_is_pressed:
+            parts = key[1].split(',')
+            found = False
+            changed = False
+            for part in parts:
+                part = part.strip()
+                current_part = 'hsv'.find(part[0])
+                if current_part != -1:
+                    changed = changed or color[current_part] != part[1:]
+                    found = True
+                color[current_part] = part[1:]
+            if not found:
+                return None
+            expand = 1 if changed else 3
     h, s, v = tuple(map(float, color))
-    color = tuple(ceil(x * 255) for x in hsv_to_rgb(h / 360, s / 100, v / 100))
-    overlay = Image.new('RGB', (image.width, image.height), color)  # type: ignore
+    return tuple(ceil(x * 255) for x in hsv_to_rgb(h / 360, s / 100, v / 100)), expand  # type: ignore
+
+
+def state() -> tuple:
+    keyboard = manager.keyboard
+    if keyboard.current_key_is_pressed:
+        return keyboard.name, keyboard.current_key.name, tuple(overlay_color)  # pressing a key might pick a color
+    # only what the key ends up looking like matters, so that picking a color only changes the keys it has to
+    return get_overlay(keyboard)
+
+
+def describe() -> Optional[list[tuple]]:
+    # see keyboard.pipeline
+    keyboard = manager.keyboard
+    if keyboard.name == 'color_picker' and keyboard.current_key_is_pressed:
+        return None  # picking a color is up to process
+    overlay = get_overlay(keyboard)
+    if overlay is None:
+        return []
+    color, expand = overlay
+    return [('multiply', color)] if expand is None else None
+
+
+def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
+    keyboard = manager.keyboard
+    if keyboard.name == 'color_picker' and keyboard.current_key_is_pressed:
+        key = keyboard.current_key.name.split(':')
+        if len(key) == 2 and key[0] == 'cell':
+            parts = key[1].split(',')
+            changed = False
+            for part in parts:
+                part = part.strip()
+                current_part = 'hsv'.find(part[0])
+                if current_part != -1:
+                    overlay_color[current_part] = part[1:]
+                    changed = True
+            return None if changed else image
+    overlay = get_overlay(keyboard)
+    if overlay is None:
+        return image
+    color, expand = overlay
+    if expand is not None:
+        image = ImageOps.expand(image, round(image.width * (char_scale - 1) / expand))
+    overlay = Image.new('RGB', (image.width, image.height), color)
     overlay.putalpha(255)
     return ImageChops.multiply(image, overlay)
@@ -9,33 +9,71 @@ current_char = 0
 char_scale = 1.5
 
 
-def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
-    keyboard = manager.keyboard
+def get_overlay(keyboard) -> Optional[tuple[tuple[int, int, int], bool]]:
+    """
+    Works out how the current key should be recolored, without picking a color.
+
+    :return: None if the key should be left as is, otherwise a tuple of the overlay color and whether the key
+             should be padded to highlight a color picker key.
+    """
     if 'words' in keyboard.name or 'words' in keyboard.current_key.name:
-        return image
+        return None
     if keyboard.current_key.name in (keyboard.backspace_key, keyboard.enter_key):
-        return image
-    global overlay_color, current_char
+        return None
     color = overlay_color.copy()
+    pad = False
     if keyboard.name == 'color_picker_rgb':
+        key_name = keyboard.current_key.name
+        if key_name.isnumeric() and key_name.isascii() and not keyboard.current_key_is_pressed:
+            key_name = chr(int(key_name))
+            if key_name in 'RGB':
+                color = [color[i] if 'RGB'.index(key_name) == i else '0' for i in range(len(color))]
+                pad = 'RGB'[current_char] != key_name
+            elif key_name in '0123456789abcdef':
+                pad = color[current_char] != key_name
+                color[current_char] = key_name
+    return ImageColor.getrgb('#' + ''.join(color)), pad  # type: ignore
+
+
+def state() -> tuple:
+    keyboard = manager.keyboard
+    if keyboard.current_key_is_pressed:
+        # pressing a key might pick a color
+        return keyboard.name, keyboard.current_key.name, tuple(overlay_color), current_char
+    # only what the key ends up looking like matters, so that picking a color only changes the keys it has to
+    return get_overlay(keyboard)
+
+
+def describe() -> Optional[list[tuple]]:
+    # see keyboard.pipeline
+    keyboard = manager.keyboard
+    if keyboard.name == 'color_picker_rgb' and keyboard.current_key_is_pressed:
+        return None  # picking a color is up to process
+    overlay = get_overlay(keyboard)
+    if overlay is None:
+        return []
+    color, pad = overlay
+    return None if pad else [('multiply', color)]
+
+
+def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
+    global current_char
+    keyboard = manager.keyboard
+    if keyboard.name == 'color_picker_rgb' and keyboard.current_key_is_pressed:
         key_name = keyboard.current_key.name
         if key_name.isnumeric() and key_name.isascii():
             key_name = chr(int(key_name))
-            if keyboard.current_key_is_pressed:
-                if key_name in 'RGB':
-                    current_char = 'RGB'.index(key_name)
-                elif key_name in '0123456789abcdef':
-                    overlay_color[current_char] = key_name
-                return None
-            else:
-                if key_name in 'RGB':
-                    color = [color[i] if 'RGB'.index(key_name) == i else '0' for i in range(len(color))]
-                    if 'RGB'[current_char] != key_name:
-                        image = ImageOps.pad(image, (image.width, round(image.height * char_scale)))
-                elif key_name in '0123456789abcdef':
-                    if color[current_char] != key_name:
-                        image = ImageOps.pad(image, (image.width, round(image.height * char_scale)))
-                    color[current_char] = key_name
-    overlay = Image.new('RGB', (image.width, image.height), ImageColor.getrgb('#' + ''.join(color)))
+            if key_name in 'RGB':
+                current_char = 'RGB'.index(key_name)
+            elif key_name in '0123456789abcdef':
+                overlay_color[current_char] = key_name
+            return None
+    overlay = get_overlay(keyboard)
+    if overlay is None:
+        return image
+    color, pad = overlay
+    if pad:
+        image = ImageOps.pad(image, (image.width, round(image.height * char_scale)))
+    overlay = Image.new('RGB', (image.width, image.height), color)
     overlay.putalpha(255)
     return ImageChops.multiply(image, overlay)
@@ -4,6 +4,7 @@ from PIL import Image
 from glitch_this import ImageGlitcher
 
 glitch = ImageGlitcher()
+cacheable = False  # the glitches are random, see keyboard.cache.processing_key
 
 
 def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
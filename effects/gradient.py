@@ -1,4 +1,6 @@
+from collections import OrderedDict
 from math import cos, sin, radians
+from threading import Lock
 
 from PIL import Image, ImageDraw
 
@@ -91,9 +93,200 @@ def degrees_gradient(im, rect, color_func, color_palette, degrees):
                 draw.point((x, y), color)
 
 
+# How many ramp entries render_gradient uses between two palette colors. With 256, sampling the nearest entry
+# instead of the exact position is off by less than one color level.
+RAMP_RESOLUTION = 256
+# Angles whose sine or cosine is smaller than this are treated as axis-aligned.
+AXIS_EPSILON = 1e-9
+
+
+def is_axis_aligned(cos_d, sin_d):
+    return abs(sin_d) < AXIS_EPSILON or abs(cos_d) < AXIS_EPSILON
+
+
+def render_strip(length, color_palette, step, horizontal):
+    """ Renders the colors of an axis-aligned gradient along its axis, as a length x 1 image if it's horizontal
+        (step is the cosine of the angle), or as a 1 x length image if it's vertical (step is the sine).
+    """
+    ends = (0, (length - 1) * step)
+    min_d, max_d = min(ends), max(ends)
+    strip = Image.new('RGB', (length, 1) if horizontal else (1, length))
+    strip.putdata([gradient_color(min_d, max_d, i * step, color_palette) for i in range(length)])
+    return strip
+
+
+def render_ramp(color_palette):
+    """ Renders the colors of a gradient at RAMP_RESOLUTION positions per palette step, as a 1-pixel high image.
+        The first and last colors are repeated once more at either end.
+    """
+    length = max(len(color_palette) - 1, 1) * RAMP_RESOLUTION + 1
+    ramp = Image.new('RGB', (length + 2, 1))
+    colors = [gradient_color(0, length - 1, i, color_palette) for i in range(length)]
+    # the ends are repeated in case rounding takes a pixel just past them
+    ramp.putdata([colors[0]] + colors + [colors[-1]])
+    return ramp
+
+
+def map_ramp(ramp, width, height, degrees):
+    """ Maps a ramp from render_ramp onto a width x height image along the angle, the same way degrees_gradient
+        maps the palette onto the pixels.
+    """
+    rad = radians(degrees)
+    cos_d, sin_d = cos(rad), sin(rad)
+    corners = [x * cos_d + y * sin_d for x in (0, width - 1) for y in (0, height - 1)]
+    min_d, max_d = min(corners), max(corners)
+    range_d = max_d - min_d
+    length = ramp.width - 2
+    scale = (length - 1) / range_d if range_d > 0 else 0
+    # Image.transform samples at pixel centers: the ramp position of pixel (x, y) is
+    # scale * (x * cos + y * sin - min_d), plus 1 for the repeated end and 0.5 to round to the nearest entry
+    a, b = scale * cos_d, scale * sin_d
+    c = 1.5 - scale * min_d - 0.5 * (a + b)
+    return ramp.transform((width, height), Image.AFFINE, (a, b, c, 0, 0, 0.5), Image.NEAREST)
+
+
+def render_gradient(width, height, color_palette, degrees):
+    """ Renders the same gradient as degrees_gradient on a width x height image,
+        without computing any pixel in Python. The colors along the gradient are computed once
+        (exactly, as a 1-D strip, for axis-aligned gradients, or as a fine-grained ramp otherwise),
+        and Pillow maps them onto every pixel.
+    """
+    rad = radians(degrees)
+    cos_d, sin_d = cos(rad), sin(rad)
+    if is_axis_aligned(cos_d, sin_d):
+        horizontal = abs(sin_d) < AXIS_EPSILON
+        strip = render_strip(width if horizontal else height, color_palette, cos_d if horizontal else sin_d, horizontal)
+        return strip.resize((width, height), Image.NEAREST)
+    return map_ramp(render_ramp(color_palette), width, height, degrees)
+
+
+def render_stripes(width, height, color_palette, degrees):
+    """ Renders one band of every palette color across a width x height image along the angle, with hard edges:
+        every band is equally wide, and every pixel gets the color of the band its center is in.
+        Axis-aligned bands are drawn as one rectangle each, rotated ones are looked up from a 1-pixel-per-band ramp.
+    """
+    count = len(color_palette)
+    rad = radians(degrees)
+    cos_d, sin_d = cos(rad), sin(rad)
+    if is_axis_aligned(cos_d, sin_d):
+        horizontal = abs(sin_d) < AXIS_EPSILON
+        length = width if horizontal else height
+        colors = color_palette if (cos_d if horizontal else sin_d) > 0 else color_palette[::-1]
+        image = Image.new('RGB', (width, height))
+        draw = ImageDraw.Draw(image)
+        for i, color in enumerate(colors):
+            # the first and last pixels whose centers are in the band: i <= (p + 0.5) * count / length < i + 1
+            start, end = -((count - 2 * i * length) // (2 * count)), -((count - 2 * (i + 1) * length) // (2 * count))
+            if end > start:
+                draw.rectangle((start, 0, end - 1, height - 1) if horizontal else (0, start, width - 1, end - 1),
+                               fill=tuple(color))
+        return image
+    corners = [x * cos_d + y * sin_d for x in (0, width) for y in (0, height)]
+    min_d, max_d = min(corners), max(corners)
+    ramp = Image.new('RGB', (count + 2, 1))
+    # the ends are repeated in case rounding takes a pixel just past them
+    ramp.putdata([tuple(color_palette[0])] + [tuple(color) for color in color_palette] + [tuple(color_palette[-1])])
+    scale = count / (max_d - min_d)
+    # the band of pixel (x, y) is scale * ((x + 0.5) * cos + (y + 0.5) * sin - min_d), Image.transform adds the 0.5
+    return ramp.transform((width, height), Image.AFFINE,
+                          (scale * cos_d, scale * sin_d, 1 - scale * min_d, 0, 0, 0.5), Image.NEAREST)
+
+
+class GradientCache(object):
+    """ A process-wide LRU cache of rendered gradients, limited by the total size of the cached pixel data.
+
+        You should not directly instantiate the class, instead you do::
+
+            from effects.gradient import gradient_cache
+
+        to access the cache shared by all effects.
+
+        Every gradient is sampled from the palette's ramp (see render_ramp), which doesn't depend on the size.
+        Axis-aligned gradients only change along one axis, so only that 1-D strip is cached (by palette, direction
+        and length along the axis), and it's expanded to the full size when it's requested. A message that grows
+        across the gradient (e.g. downwards with angle 0) keeps using the same strip. Other gradients are cached
+        by palette, angle and size.
+    """
+
+    def __init__(self, limit=32 * 1024 * 1024):
+        """ limit: The maximum total size of the cached images, in bytes.
+        """
+        self.limit = limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.images = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def get_size(image):
+        return image.width * image.height * len(image.getbands())
+
+    def load(self, k, loader):
+        """ Returns the image cached under k, calling loader to render and cache it if it's not there yet.
+            Cached images are shared, so they should never be modified in place.
+        """
+        with self.lock:
+            image = self.images.get(k, None)
+            if image is not None:
+                self.hits += 1
+                self.images.move_to_end(k)
+                return image
+            self.misses += 1
+        # rendered outside the lock, so two threads may occasionally render the same gradient
+        image = loader()
+        size = self.get_size(image)
+        if size > self.limit:
+            return image
+        with self.lock:
+            if k in self.images:
+                self.size -= self.get_size(self.images.pop(k))
+            self.images[k] = image
+            self.size += size
+            while self.size > self.limit:
+                _, evicted = self.images.popitem(last=False)
+                self.size -= self.get_size(evicted)
+        return image
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+
+    def gradient(self, width, height, color_palette, degrees):
+        """ Same as render_gradient, but renders as little as possible. The result is a new image
+            that can be modified.
+        """
+        palette = tuple(tuple(color) for color in color_palette)
+        ramp = self.load(('ramp', palette), lambda: render_ramp(palette))
+        rad = radians(degrees)
+        cos_d, sin_d = cos(rad), sin(rad)
+        if is_axis_aligned(cos_d, sin_d):
+            horizontal = abs(sin_d) < AXIS_EPSILON
+            strip_size = (width, 1) if horizontal else (1, height)
+            # sampling the ramp is much faster than computing every color of the strip, like render_strip does
+            strip = self.load(('strip', palette, horizontal, (cos_d if horizontal else sin_d) > 0, strip_size),
+                              lambda: map_ramp(ramp, *strip_size, degrees))
+            return strip.resize((width, height), Image.NEAREST)
+        return self.load(('image', palette, degrees, width, height),
+                         lambda: map_ramp(ramp, width, height, degrees)).copy()
+
+    def stripes(self, width, height, color_palette, degrees):
+        """ Same as render_stripes, but cached by palette, angle and size. The result is a new image
+            that can be modified.
+        """
+        palette = tuple(tuple(color) for color in color_palette)
+        return self.load(('stripes', palette, degrees, width, height),
+                         lambda: render_stripes(width, height, palette, degrees)).copy()
+
+
+"""The singleton; check ``effects.gradient.GradientCache`` for details on usage."""
+gradient_cache = GradientCache()
+
+
 def gradient_image(width, height, color_palette, degrees):
-    region = Rect(0, 0, width - 1, height - 1)
-    x, y = region.max.x + 1, region.max.y + 1
-    image = Image.new('RGB', (x, y), (255, 255, 255))
-    degrees_gradient(image, region, gradient_color, color_palette, -degrees)
-    return image.crop((0, 0, width, height))
+    return gradient_cache.gradient(width, height, color_palette, -degrees)
+
+
+def stripe_image(width, height, color_palette, degrees):
+    return gradient_cache.stripes(width, height, color_palette, -degrees)
@@ -11,6 +11,10 @@ colors = [(0, 204, 102), (0, 102, 51)]
 angle = 0
 
 
+def describe() -> list[tuple]:
+    return [('gradient_background', colors, angle)]  # see keyboard.pipeline
+
+
 def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
     if image is None:
         return
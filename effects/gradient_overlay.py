@@ -11,6 +11,10 @@ colors = rainbow
 angle = 0
 
 
+def describe() -> list[tuple]:
+    return [('gradient_multiply', colors, angle)]  # see keyboard.pipeline
+
+
 def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
     if image is None:
         return
@@ -5,6 +5,10 @@ from PIL import Image, ImageChops
 color = (0, 192, 96)
 
 
+def describe() -> list[tuple]:
+    return [('multiply', color)]  # see keyboard.pipeline
+
+
 def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
     if image is None:
         return
@@ -3,7 +3,7 @@ from typing import Optional
 from PIL import Image, ImageChops
 from PIL.ImageColor import getrgb
 
-from effects.gradient import gradient_image
+from effects.gradient import gradient_image, stripe_image
 
 # Pride flag overlay! Works best as postprocessing and with white text.
 # You can use HTML, RGB, HSL, HSV, or color names. See https://pillow.readthedocs.io/en/stable/reference/ImageColor.html
@@ -19,14 +19,18 @@ agender = ['#000000', '#BCC4C6', '#FFFFFF', '#B6F583', '#FFFFFF', '#BCC4C6', '#0
 # Feel free to add flags of your own choosing.
 
 palette = gay  # choose your palette here!
-multiplier = 5  # increase for sharper stripe edges
+stripes = True  # sharp stripe edges like on the flag; False blends the colors into each other instead
 angle = 0  # in case you want your flag sideways?
-colors = [getrgb(part) for part in palette for _ in range(multiplier)]  # don't touch unless you know what you're doing.
+colors = [getrgb(part) for part in palette]  # don't touch unless you know what you're doing.
+
+
+def describe() -> list[tuple]:
+    return [('stripe_multiply' if stripes else 'gradient_multiply', colors, angle)]  # see keyboard.pipeline
 
 
 def process(image: Optional[Image.Image]) -> Optional[Image.Image]:
     if image is None:
         return
-    overlay = gradient_image(image.width, image.height, colors, angle)
+    overlay = (stripe_image if stripes else gradient_image)(image.width, image.height, colors, angle)
     overlay.putalpha(255)
     return ImageChops.multiply(image, overlay)
@@ -0,0 +1,100 @@
+import os
+from threading import Lock
+from typing import Optional
+
+ASSET_ROOT = 'keyboards/assets'
+
+
+class AssetIndex:
+    """
+    An in-memory index of the asset files, so that resolving key names doesn't have to ask the filesystem.
+
+    You should not directly instantiate the class, instead you do::
+
+        from keyboard.assets import asset_index
+
+    to access the index shared by all keys.
+
+    Every folder is scanned the first time it's used. Folders are scanned again by ``refresh`` if files were added,
+    removed or renamed since (i.e. if the folder's modification time changed), and by ``clear``, e.g. on reload.
+    """
+
+    def __init__(self, root: str = ASSET_ROOT) -> None:
+        """
+        Creates an empty index.
+
+        :param root: The asset root folder.
+        """
+        self.root = root
+        self.folders = dict()  # folder path -> (folder modification time, {file name: file modification time})
+        self.lock = Lock()
+
+    def scan(self, folder: str) -> dict[str, float]:
+        """
+        Get the files of a folder, scanning it if it's not in the index yet.
+
+        :param folder: The folder path, e.g. ``keyboards/assets/util``.
+        :return: A dictionary of file names (with extensions, case-normalized like ``os.path.normcase``)
+                 and their modification times.
+        """
+        entry = self.folders.get(folder, None)
+        if entry is not None:
+            return entry[1]
+        try:
+            mtime = os.stat(folder).st_mtime
+            with os.scandir(folder) as entries:
+                files = {os.path.normcase(file.name): file.stat().st_mtime for file in entries if file.is_file()}
+        except OSError:
+            mtime, files = None, dict()
+        with self.lock:
+            self.folders[folder] = (mtime, files)
+        return files
+
+    def refresh(self) -> int:
+        """
+        Scans the indexed folders whose contents changed again. Costs one ``stat`` per indexed folder.
+
+        :return: The number of folders that were scanned again.
+        """
+        with self.lock:
+            folders = list(self.folders.items())
+        changed = 0
+        for folder, (mtime, _) in folders:
+            try:
+                new_mtime = os.stat(folder).st_mtime
+            except OSError:
+                new_mtime = None
+            if new_mtime != mtime:
+                with self.lock:
+                    self.folders.pop(folder, None)
+                self.scan(folder)
+                changed += 1
+        return changed
+
+    def clear(self) -> None:
+        with self.lock:
+            self.folders.clear()
+
+    def exists(self, path: str) -> bool:
+        """
+        Check if a file exists, according to the index.
+
+        :param path: The file path, e.g. ``keyboards/assets/util/none.png``.
+        :return: True if the file exists, False otherwise.
+        """
+        folder, _, name = path.rpartition('/')
+        return os.path.normcase(name) in self.scan(folder)
+
+    def get_mtime(self, path: str) -> Optional[float]:
+        """
+        Get the modification time of a file as of the last time its folder was scanned.
+
+        :param path: The file path, e.g. ``keyboards/assets/util/none.png``.
+        :return: The modification time, or None if the file doesn't exist.
+        """
+        folder, _, name = path.rpartition('/')
+        return self.scan(folder).get(os.path.normcase(name), None)
+
+
+"""The singleton; check ``keyboard.assets.AssetIndex`` for details on usage."""
+asset_index = AssetIndex()
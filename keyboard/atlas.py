@@ -0,0 +1,101 @@
+from typing import Union
+
+from PIL import Image
+from pyglet.image import ImageData, TextureRegion
+from pyglet.image.atlas import TextureBin
+
+from .key import to_image_data
+
+
+class KeyAtlas:
+    """
+    Packs key images into a few shared textures, so that sprites in the same ``BatchNode``
+    can be drawn in a handful of draw calls instead of switching textures for every key.
+
+    Images are added by their PIL image, so keys that show the same (cached) image share one atlas region.
+    Regions are never freed individually; instead, the atlas keeps track of how much of it is still in use
+    and can be reset when too much of it is wasted (see ``waste``).
+    """
+
+    def __init__(self, size: int = 1024, border: int = 1) -> None:
+        """
+        Creates an empty atlas.
+
+        :param size: Width and height of the atlas textures. Images that don't fit get a texture of their own.
+        :param border: Blank space left around every image, so that neighbouring images don't bleed into it
+                       when the sprite is scaled.
+        """
+        self.size = size
+        self.border = border
+        self.bin = TextureBin(size, size)
+        self.regions = dict()  # id(image) -> [image, region, reference count]
+        self.generation = 0  # incremented on every reset, so that releases from before it can be told apart
+        self.allocated_area = 0
+        self.used_area = 0
+
+    def get_area(self, image: Image.Image) -> int:
+        return (image.width + self.border * 2) * (image.height + self.border * 2)
+
+    def fits(self, image: Image.Image) -> bool:
+        return max(image.width, image.height) + self.border * 2 <= min(self.bin.texture_width, self.bin.texture_height)
+
+    def add(self, image: Image.Image) -> Union[ImageData, TextureRegion]:
+        """
+        Get an atlas region showing ``image``, adding it to the atlas if it's not there yet.
+
+        Every call should be matched by a call to ``release`` once the region is no longer displayed,
+        with the ``generation`` the atlas had when the image was added.
+
+        :param image: The image to add.
+        :return: The atlas region, or standalone image data if the image is too large for the atlas.
+        """
+        entry = self.regions.get(id(image), None)
+        if entry is not None:
+            entry[2] += 1
+            return entry[1]
+        if not self.fits(image):
+            return to_image_data(image)
+        region = self.bin.add(to_image_data(image), self.border)
+        # keeping a reference to the image also makes sure its id isn't reused while it's in the atlas
+        self.regions[id(image)] = [image, region, 1]
+        self.allocated_area += self.get_area(image)
+        self.used_area += self.get_area(image)
+        return region
+
+    def release(self, image: Image.Image, generation: int) -> None:
+        """
+        Mark a region returned by ``add`` as no longer displayed.
+
+        :param image: The image that was added.
+        :param generation: The atlas ``generation`` at the time the image was added.
+        """
+        if generation != self.generation:
+            return  # added before the last reset; the same image may have been added again since then
+        entry = self.regions.get(id(image), None)
+        if entry is None:
+            return  # too large for the atlas
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self.regions[id(image)]
+            self.used_area -= self.get_area(image)
+
+    @property
+    def waste(self) -> float:
+        """
+        Get the fraction of the allocated atlas area that belongs to images which are no longer displayed.
+        """
+        if self.allocated_area == 0:
+            return 0.0
+        return 1 - self.used_area / self.allocated_area
+
+    def reset(self) -> None:
+        """
+        Start over with empty textures. Sprites that still use the old textures keep working,
+        and the old textures are freed once none of them use them anymore.
+        """
+        self.bin = TextureBin(self.size, self.size)
+        self.regions.clear()
+        self.generation += 1
+        self.allocated_area = 0
+        self.used_area = 0
+
@@ -0,0 +1,365 @@
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from struct import Struct
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from traceback import print_exc
+from typing import Callable, Hashable, Optional
+
+from PIL import Image
+
+
+class AssetCache:
+    """
+    A process-wide LRU cache of decoded and resized key images, limited by the total size of the cached pixel data.
+
+    You should not directly instantiate the class, instead you do::
+
+        from keyboard.cache import asset_cache
+
+    to access the cache shared by all keys.
+
+    Cached images are shared between keys, so they should never be modified in place.
+    The cache can be used from several threads at once; loaders run outside the lock,
+    so two threads may occasionally load the same image, and the later one wins.
+    """
+
+    def __init__(self, limit: int = 128 * 1024 * 1024) -> None:
+        """
+        Creates an empty cache.
+
+        :param limit: The maximum total size of the cached images, in bytes.
+        """
+        self.limit = limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.images = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def get_size(image: Image.Image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, k: Hashable) -> Optional[Image.Image]:
+        """
+        Looks up an image and marks it as the most recently used one.
+
+        :param k: The cache key.
+        :return: The cached image, or None if there is no image cached under ``k``.
+        """
+        with self.lock:
+            image = self.images.get(k, None)
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.images.move_to_end(k)
+            return image
+
+    def put(self, k: Hashable, image: Image.Image) -> Image.Image:
+        """
+        Adds an image to the cache, evicting the least recently used images if the cache grows over its limit.
+
+        Images that are larger than the whole cache are returned as is without being cached.
+
+        :param k: The cache key.
+        :param image: The image to cache.
+        :return: The image that was passed in.
+        """
+        size = self.get_size(image)
+        if size > self.limit:
+            return image
+        with self.lock:
+            if k in self.images:
+                self.size -= self.get_size(self.images.pop(k))
+            self.images[k] = image
+            self.size += size
+            while self.size > self.limit:
+                _, evicted = self.images.popitem(last=False)
+                self.size -= self.get_size(evicted)
+                self.evictions += 1
+        return image
+
+    def load(self, k: Hashable, loader: Callable[[], Image.Image]) -> Image.Image:
+        """
+        Returns the image cached under ``k``, calling ``loader`` to create and cache it if it's not there yet.
+
+        :param k: The cache key.
+        :param loader: A function that creates the image.
+        :return: The cached or newly created image.
+        """
+        image = self.get(k)
+        if image is None:
+            image = self.put(k, loader())
+        return image
+
+    def clear(self) -> None:
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get the cache statistics, e.g. for checking whether the size limit is large enough.
+
+        :return: A dictionary of image count, total size in bytes, size limit, hits, misses and evictions.
+        """
+        return {
+            'images': len(self.images),
+            'size': self.size,
+            'limit': self.limit,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def is_cacheable(func: Callable) -> bool:
+    return getattr(func, 'cacheable', True)
+
+
+def processing_key(func: Callable) -> Hashable:
+    """
+    Get the identity of a processing function for use in cache keys.
+
+    Processing functions can have a ``state`` attribute, which should be a function returning a hashable value
+    that describes everything the processing result depends on besides the image itself
+    (see ``KeyboardManager.load_processing``). It is called in the same context as the processing function would be.
+    Functions whose results can't be reused at all (e.g. random ones) should set their ``cacheable`` attribute to False.
+
+    :param func: The processing function.
+    :return: A hashable value that only compares equal for functions that produce the same result.
+    """
+    if not is_cacheable(func):
+        return object()
+    state = getattr(func, 'state', None)
+    if state is None:
+        return func
+    try:
+        return func, state()
+    except Exception:
+        print_exc()
+        return func, object()  # never equal to anything else, so the result won't be reused
+
+
+def persistent_key(func: Callable) -> Optional[Hashable]:
+    """
+    Get the identity of a processing function that stays the same between runs, for use in disk cache keys.
+
+    Besides ``state`` (see ``processing_key``), this needs a ``version`` attribute describing the code of the function,
+    which should change whenever the function starts producing different results for the same state.
+
+    :param func: The processing function.
+    :return: A value with a stable ``repr``, or None if the results of the function shouldn't be stored on disk.
+    """
+    version = getattr(func, 'version', None)
+    if version is None or not is_cacheable(func):
+        return None
+    state = getattr(func, 'state', None)
+    try:
+        return version, (None if state is None else state())
+    except Exception:
+        print_exc()
+        return None
+
+
+class DiskCache:
+    """
+    A cache of rendered key images that persists between runs, stored as raw RGBA files in a folder
+    and limited by their total size. The least recently used files are removed first.
+
+    You should not directly instantiate the class, instead you do::
+
+        from keyboard.cache import disk_cache
+
+    to access the cache shared by all keys.
+
+    Cache keys have to be made of values whose ``repr`` stays the same between runs (strings, numbers, tuples).
+    Anything the image depends on, like asset modification times, should be part of the key,
+    so that outdated entries are never found and just get removed once the cache is full.
+    """
+
+    header = Struct('<4sII')
+    magic = b'QKC1'
+
+    def __init__(self, folder: str = 'cache', limit: int = 64 * 1024 * 1024) -> None:
+        """
+        Creates a cache in ``folder``. The folder is only read once the cache is first used.
+
+        :param folder: The cache folder.
+        :param limit: The maximum total size of the cached files, in bytes. 0 disables the cache.
+        """
+        self.folder = folder
+        self.limit = limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.files = None  # file name -> size, least recently used first
+        self.lock = Lock()
+
+    def get_name(self, k: Hashable) -> str:
+        return sha1(repr(k).encode('utf-8')).hexdigest() + '.rgba'
+
+    def scan(self) -> None:
+        # must be called with the lock held
+        if self.files is not None:
+            return
+        self.files = OrderedDict()
+        self.size = 0
+        try:
+            entries = [entry for entry in os.scandir(self.folder) if entry.name.endswith('.rgba') and entry.is_file()]
+        except OSError:
+            return
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            self.files[entry.name] = entry.stat().st_size
+            self.size += entry.stat().st_size
+
+    def get(self, k: Hashable) -> Optional[Image.Image]:
+        """
+        Looks up an image and marks it as the most recently used one.
+
+        :param k: The cache key.
+        :return: The cached image, or None if there is no image cached under ``k``.
+        """
+        if self.limit <= 0:
+            return None
+        name = self.get_name(k)
+        with self.lock:
+            self.scan()
+            if name not in self.files:
+                self.misses += 1
+                return None
+            self.files.move_to_end(name)
+        path = os.path.join(self.folder, name)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            magic, width, height = self.header.unpack_from(data)
+            if magic != self.magic or len(data) != self.header.size + width * height * 4:
+                raise ValueError(f'{path} is not a valid cache file')
+            image = Image.frombytes('RGBA', (width, height), data[self.header.size:])
+            os.utime(path)  # so that the order survives restarts
+        except (OSError, ValueError):
+            with self.lock:
+                self.size -= self.files.pop(name, 0)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return image
+
+    def contains(self, k: Hashable) -> bool:
+        """
+        Check if an image is cached, without reading it or marking it as used.
+
+        :param k: The cache key.
+        :return: True if there's a file for ``k``, False otherwise.
+        """
+        if self.limit <= 0:
+            return False
+        name = self.get_name(k)
+        with self.lock:
+            self.scan()
+            return name in self.files
+
+    def put(self, k: Hashable, image: Image.Image) -> Image.Image:
+        """
+        Writes an image to the cache, removing the least recently used files if the cache grows over its limit.
+
+        :param k: The cache key.
+        :param image: The image to cache.
+        :return: The image that was passed in, converted to RGBA so that it matches what ``get`` returns.
+        """
+        if self.limit <= 0:
+            return image
+        rgba_image = image if image.mode == 'RGBA' else image.convert('RGBA')
+        data = self.header.pack(self.magic, rgba_image.width, rgba_image.height) + rgba_image.tobytes()
+        if len(data) > self.limit:
+            return rgba_image
+        name = self.get_name(k)
+        temp_path = None
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            # write to a temporary file first, so that other runs never see half-written files
+            with NamedTemporaryFile('wb', dir=self.folder, suffix='.tmp', delete=False) as file:
+                temp_path = file.name
+                file.write(data)
+            os.replace(temp_path, os.path.join(self.folder, name))
+        except OSError:
+            print_exc()
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)  # the size limit only counts finished files, so it would never be removed
+                except OSError:
+                    pass
+            return rgba_image
+        with self.lock:
+            self.scan()
+            self.size -= self.files.pop(name, 0)
+            self.files[name] = len(data)
+            self.size += len(data)
+            evicted = []
+            while self.size > self.limit:
+                evicted_name, evicted_size = self.files.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+                evicted.append(evicted_name)
+        for evicted_name in evicted:
+            try:
+                os.remove(os.path.join(self.folder, evicted_name))
+            except OSError:
+                pass
+        return rgba_image
+
+    def load(self, k: Hashable, loader: Callable[[], Image.Image]) -> Image.Image:
+        """
+        Returns the image cached under ``k``, calling ``loader`` to create and cache it if it's not there yet.
+
+        :param k: The cache key.
+        :param loader: A function that creates the image.
+        :return: The cached or newly created image.
+        """
+        image = self.get(k)
+        if image is None:
+            image = self.put(k, loader())
+        return image
+
+    def clear(self) -> None:
+        with self.lock:
+            self.scan()
+            names = list(self.files)
+            self.files.clear()
+            self.size = 0
+        for name in names:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get the cache statistics, e.g. for checking whether the size limit is large enough.
+
+        :return: A dictionary of file count, total size in bytes, size limit, hits, misses and evictions.
+        """
+        with self.lock:
+            self.scan()
+            return {
+                'files': len(self.files),
+                'size': self.size,
+                'limit': self.limit,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+"""The singleton; check ``keyboard.cache.AssetCache`` for details on usage."""
+asset_cache = AssetCache()
+
+"""The singleton; check ``keyboard.cache.DiskCache`` for details on usage."""
+disk_cache = DiskCache()
@@ -0,0 +1,96 @@
+from typing import Optional
+
+from PIL import Image
+
+"""An undo record: the position and contents of the overwritten area, and the canvas size before the change."""
+Patch = tuple[tuple[int, int], Image.Image, Optional[tuple[int, int]]]
+
+
+class Canvas:
+    """
+    The image that typed keys are composed onto.
+
+    The backing image grows geometrically and is only cropped to the actual size when the image is requested,
+    so adding a key only touches the pixels of that key instead of copying everything typed so far.
+    Pixels outside the actual size are always transparent.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = None  # the backing image, at least as large as the canvas
+        self.size = None  # the actual size, or None if nothing was drawn yet
+        self.image = None  # the cropped image, if it was requested since the last change
+
+    def get_image(self) -> Optional[Image.Image]:
+        """
+        Get the canvas contents. The result is cached until the canvas changes and should not be modified in place.
+
+        :return: The canvas image cropped to its actual size, or None if the canvas is empty.
+        """
+        if self.size is None:
+            return None
+        if self.image is None:
+            if self.buffer.size == self.size:
+                self.image = self.buffer.copy()
+            else:
+                self.image = self.buffer.crop((0, 0, *self.size))
+        return self.image
+
+    def set_image(self, image: Optional[Image.Image]) -> None:
+        """
+        Replaces the canvas contents.
+
+        :param image: The new contents, or None to clear the canvas.
+        """
+        if image is None:
+            self.buffer, self.size = None, None
+        else:
+            self.buffer, self.size = image.convert('RGBA') if image.mode != 'RGBA' else image.copy(), image.size
+        self.image = None
+
+    def reserve(self, width: int, height: int) -> None:
+        """
+        Makes sure that the backing image is at least ``width`` by ``height`` pixels large,
+        at least doubling its size if it has to grow.
+        """
+        if self.buffer is None:
+            self.buffer = Image.new(mode='RGBA', size=(width, height), color=(0, 0, 0, 0))
+            return
+        if width <= self.buffer.width and height <= self.buffer.height:
+            return
+        new_size = (
+            self.buffer.width if width <= self.buffer.width else max(width, self.buffer.width * 2),
+            self.buffer.height if height <= self.buffer.height else max(height, self.buffer.height * 2),
+        )
+        new_buffer = Image.new(mode='RGBA', size=new_size, color=(0, 0, 0, 0))
+        new_buffer.paste(self.buffer)
+        self.buffer = new_buffer
+
+    def paste(self, image: Image.Image, position: tuple[int, int]) -> Patch:
+        """
+        Pastes an image onto the canvas, growing the canvas to fit it if needed.
+
+        :param image: The image to paste.
+        :param position: The (x, y) position of its top left corner.
+        :return: The undo record for ``undo``.
+        """
+        x, y = position
+        old_size = self.size
+        width, height = old_size if old_size is not None else (0, 0)
+        self.reserve(max(width, x + image.width), max(height, y + image.height))
+        box = (x, y, x + image.width, y + image.height)
+        patch = self.buffer.crop(box)
+        self.buffer.paste(image, box)
+        self.size = (max(width, x + image.width), max(height, y + image.height))
+        self.image = None
+        return position, patch, old_size
+
+    def undo(self, patch: Patch) -> None:
+        """
+        Reverts a change made by ``paste``. Changes have to be reverted in the opposite order they were made in.
+
+        :param patch: The undo record returned by ``paste``.
+        """
+        position, image, old_size = patch
+        self.buffer.paste(image, position)
+        self.size = old_size
+        self.image = None
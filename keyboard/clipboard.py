@@ -0,0 +1,170 @@
+import os
+import subprocess
+import sys
+from abc import abstractmethod
+from threading import Lock
+from typing import Callable, Optional
+
+import pyperclip
+
+from .output import CoalescingWorker
+
+
+class ClipboardSink(CoalescingWorker):
+    """
+    Copies output files to the clipboard on a background thread, so that rendering never waits for the clipboard.
+    Only the latest file matters, so files submitted while the clipboard is busy replace each other.
+
+    Subclasses implement ``publish`` for a specific clipboard. You should not directly instantiate them,
+    instead you do::
+
+        from keyboard import manager
+
+    and use ``manager.clipboard_sink``, which is picked by the ``clipboard_sink`` setting (see ``CLIPBOARD_SINKS``).
+    """
+
+    name = 'clipboard'
+
+    def send(self, path: str, data: memoryview, mime_type: str,
+             is_valid: Optional[Callable[[], bool]] = None) -> None:
+        """
+        Schedules a file to be copied to the clipboard, both as a file and as image data where supported.
+
+        :param path: The absolute file path.
+        :param data: The file contents, or the image data to copy instead if it was encoded differently.
+                     Must not be modified afterwards.
+        :param mime_type: The MIME type of ``data``, which is used as the name of the clipboard format.
+        :param is_valid: A function that tells whether the file should still be copied, checked under the sink's
+                         lock so that a ``cancel`` that comes right after it also drops the file. Default: copy it.
+        """
+        self.submit((path, data, mime_type), is_valid=is_valid)
+
+    def process(self, task: tuple[str, memoryview, str]) -> None:
+        self.publish(*task)
+
+    @abstractmethod
+    def publish(self, path: str, data: memoryview, mime_type: str) -> None:
+        """
+        Puts a file on the clipboard. Called on the sink's thread; see ``send`` for the parameters.
+        """
+
+
+class WindowsClipboardSink(ClipboardSink):
+    """
+    Copies files to the Windows clipboard, as a file name (which Discord pastes as the file)
+    and as image data in a format named after its MIME type (which Paint.NET and Telegram paste).
+    """
+
+    def publish(self, path: str, data: memoryview, mime_type: str) -> None:
+        import win32clipboard as clp  # only available on Windows
+        clp.OpenClipboard()
+        try:
+            # You may have seen this on https://stackoverflow.com/q/66845295/17391024. You're welcome.
+            clp.EmptyClipboard()
+            clp.SetClipboardData(clp.RegisterClipboardFormat('FileNameW'), path.encode('utf-16-le') + b'\0')  # Discord
+            clp.SetClipboardData(clp.RegisterClipboardFormat(mime_type), data)  # works for PDN & TG
+        finally:
+            clp.CloseClipboard()  # otherwise no other program could use the clipboard
+
+
+class LinuxClipboardSink(ClipboardSink):
+    """
+    Copies image data to the Wayland or X11 clipboard through ``wl-copy`` or ``xclip``,
+    if that's the backend ``pyperclip.probe_clipboard`` picks (see ``BACKEND_COMMANDS``).
+
+    Both tools keep serving the clipboard from a process of their own after they've read the data,
+    so the sink only waits until the data is handed over.
+    """
+
+    # the commands that read image data of a MIME type from their standard input, by pyperclip backend name;
+    # the other backends can only copy text
+    BACKEND_COMMANDS = {
+        'wl-clipboard': lambda mime_type: ['wl-copy', '--type', mime_type],
+        'xclip': lambda mime_type: ['xclip', '-selection', 'clipboard', '-target', mime_type, '-in'],
+    }
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.backend = None  # the pyperclip backend name, once it's known
+        self.lock = Lock()
+
+    def get_backend(self) -> str:
+        """
+        Get the clipboard backend pyperclip uses, probing for it the first time it's needed
+        (which usually only reads pyperclip's probe cache).
+
+        :return: The pyperclip backend name, e.g. ``wl-clipboard`` or ``xclip``.
+        """
+        with self.lock:
+            if self.backend is None:
+                # the same backend pyperclip.determine_clipboard picks on Linux
+                self.backend = pyperclip.probe_clipboard() if pyperclip.HAS_DISPLAY else 'no'
+                if self.backend not in self.BACKEND_COMMANDS:
+                    print(f'Images can only be copied through wl-copy or xclip, but the clipboard backend is '
+                          f'"{self.backend}", so images will not be copied to the clipboard.', file=sys.stderr)
+            return self.backend
+
+    def get_command(self, mime_type: str) -> Optional[list[str]]:
+        """
+        Get the command that reads image data from its standard input and puts it on the clipboard.
+
+        :param mime_type: The MIME type of the image data.
+        :return: The command line, or None if the clipboard backend can't copy images.
+        """
+        command = self.BACKEND_COMMANDS.get(self.get_backend(), None)
+        return None if command is None else command(mime_type)
+
+    def publish(self, path: str, data: memoryview, mime_type: str) -> None:
+        command = self.get_command(mime_type)
+        if command is None:
+            return
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, close_fds=True)
+        process.communicate(input=data)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+
+class FakeClipboardSink(ClipboardSink):
+    """
+    Keeps the copied files in memory instead of using a real clipboard, e.g. for testing without a desktop session.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.copies = []  # (path, data, MIME type) of every copied file, oldest first
+
+    @property
+    def contents(self) -> Optional[tuple[str, bytes, str]]:
+        """
+        Get the file that's on the fake clipboard.
+
+        :return: The (path, data, MIME type) of the last copied file, or None if nothing was copied.
+        """
+        return self.copies[-1] if len(self.copies) > 0 else None
+
+    def publish(self, path: str, data: memoryview, mime_type: str) -> None:
+        self.copies.append((path, bytes(data), mime_type))
+
+
+"""The clipboard sinks, by setting name."""
+CLIPBOARD_SINKS = {
+    'windows': WindowsClipboardSink(),
+    'linux': LinuxClipboardSink(),
+    'fake': FakeClipboardSink(),
+}
+
+
+def get_clipboard_sink(name: str = 'auto') -> ClipboardSink:
+    """
+    Get a clipboard sink by its setting name.
+
+    :param name: A key of ``CLIPBOARD_SINKS``, or ``auto`` for the one that fits the platform.
+    :return: The clipboard sink.
+    """
+    if name == 'auto':
+        name = 'windows' if os.name == 'nt' else 'linux'
+    if name not in CLIPBOARD_SINKS:
+        print(f'Unknown clipboard sink "{name}", using "auto" instead. '
+              f'Available sinks: {", ".join(CLIPBOARD_SINKS)}')
+        return get_clipboard_sink()
+    return CLIPBOARD_SINKS[name]
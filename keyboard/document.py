@@ -0,0 +1,214 @@
+from tempfile import TemporaryFile
+from typing import Optional
+
+from PIL import Image
+
+from .canvas import Canvas
+
+
+class Glyph:
+    """
+    A single typed key: its rendered image, where it's placed, and what typing it changed.
+    """
+
+    def __init__(self, image: Image.Image, position: tuple[int, int], cursor: tuple[int, int],
+                 text_length: int = 0) -> None:
+        """
+        Creates a glyph.
+
+        :param image: The rendered glyph.
+        :param position: The (x, y) position of its top left corner.
+        :param cursor: The (x, y) key position before the glyph was typed, which is restored when it's removed.
+        :param text_length: The length of the text buffer before the glyph was typed,
+                            which it's cut back to when the glyph is removed.
+        """
+        self.image = image
+        self.position = position
+        self.cursor = cursor
+        self.text_length = text_length
+        self.patch = None  # the undo record, once the glyph is drawn onto the canvas
+        self.spilled = None  # where the image and the patch are in the spill file, if they were moved there
+
+    def get_size(self) -> int:
+        """
+        Get the memory taken by the glyph's image and undo record.
+
+        :return: The size in bytes.
+        """
+        size = 0
+        if self.image is not None:
+            size += self.image.width * self.image.height * len(self.image.getbands())
+        if self.patch is not None and self.patch[1] is not None:
+            size += self.patch[1].width * self.patch[1].height * 4
+        return size
+
+    @property
+    def box(self) -> tuple[int, int, int, int]:
+        x, y = self.position
+        return x, y, x + self.image.width, y + self.image.height
+
+
+class Document:
+    """
+    The typed message as a list of rendered glyphs, which are only drawn onto a canvas when the image is needed.
+
+    Glyphs typed since the image was last requested are drawn in one go, and removing the last glyph only restores
+    the pixels it covered, so the full image is never copied just to change a single key.
+
+    The glyph images and undo records of drawn glyphs are kept within a memory limit. Once it's exceeded,
+    the oldest ones are moved to a temporary file, or dropped if spilling is disabled. Dropped glyphs stay
+    on the canvas but can no longer be removed one by one; clearing the whole document still works.
+    """
+
+    def __init__(self, limit: int = 64 * 1024 * 1024, spill: bool = True) -> None:
+        """
+        Creates an empty document.
+
+        :param limit: The maximum memory taken by glyph images and undo records, in bytes.
+        :param spill: Whether glyphs over the limit are moved to a temporary file (True) or dropped (False).
+        """
+        self.glyphs = []
+        self.canvas = Canvas()
+        self.drawn = 0  # the number of glyphs drawn onto the canvas
+        self.limit = limit
+        self.spill = spill
+        self.size = 0  # the memory taken by glyph images and undo records
+        self.kept = 0  # the number of glyphs whose data isn't in memory anymore
+        self.frozen = 0  # the number of glyphs that were dropped, i.e. can't be removed anymore
+        self.spill_file = None
+        self.spill_size = 0
+
+    def __len__(self) -> int:
+        return len(self.glyphs)
+
+    @property
+    def undoable(self) -> int:
+        """
+        Get the number of glyphs that can be removed one by one.
+        """
+        return len(self.glyphs) - self.frozen
+
+    def append(self, glyph: Glyph) -> None:
+        self.glyphs.append(glyph)
+        self.size += glyph.get_size()
+
+    def pop(self) -> Glyph:
+        """
+        Removes the last glyph. Should only be called if ``undoable`` isn't 0.
+
+        :return: The removed glyph.
+        """
+        glyph = self.glyphs[-1]
+        if glyph.spilled is not None:
+            # glyphs are spilled oldest first and removed newest first, so this is always the end of the file
+            self.spill_size = glyph.spilled[0][0]
+            self.load(glyph)
+        self.glyphs.pop()
+        self.kept = min(self.kept, len(self.glyphs))
+        self.size -= glyph.get_size()
+        if self.drawn > len(self.glyphs):
+            self.canvas.undo(glyph.patch)
+            glyph.patch = None
+            self.drawn -= 1
+        return glyph
+
+    def clear(self) -> None:
+        self.glyphs.clear()
+        self.canvas.set_image(None)
+        self.drawn = 0
+        self.size = 0
+        self.kept = 0
+        self.frozen = 0
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.spill_size = 0
+
+    def set_image(self, image: Optional[Image.Image]) -> None:
+        """
+        Replaces the whole document with a single image.
+
+        :param image: The image, or None to clear the document.
+        """
+        self.clear()
+        if image is not None:
+            self.append(Glyph(image.copy(), (0, 0), (0, 0)))
+
+    def get_image(self) -> Optional[Image.Image]:
+        """
+        Get the image of the whole document, drawing the glyphs that aren't on the canvas yet.
+        The result is cached until the document changes and should not be modified in place.
+
+        :return: The image, or None if the document is empty.
+        """
+        pending = self.glyphs[self.drawn:]
+        if len(pending) > 0:
+            boxes = [glyph.box for glyph in pending]
+            self.canvas.reserve(max(box[2] for box in boxes), max(box[3] for box in boxes))
+            for glyph in pending:
+                glyph.patch = self.canvas.paste(glyph.image, glyph.position)
+                self.size += glyph.patch[1].width * glyph.patch[1].height * 4
+            self.drawn = len(self.glyphs)
+            self.trim()
+        return self.canvas.get_image()
+
+    def trim(self) -> None:
+        """
+        Moves the oldest drawn glyphs out of memory (see ``spill``) until the memory limit is met.
+        """
+        while self.size > self.limit and self.kept < self.drawn:
+            glyph = self.glyphs[self.kept]
+            self.size -= glyph.get_size()
+            if self.spill:
+                self.unload(glyph)
+            else:
+                self.frozen = self.kept + 1
+                glyph.image, glyph.patch = None, None
+            self.kept += 1
+
+    def unload(self, glyph: Glyph) -> None:
+        if self.spill_file is None:
+            self.spill_file = TemporaryFile()
+        records = []
+        for image in glyph.image, glyph.patch[1]:
+            data = image.tobytes()
+            self.spill_file.seek(self.spill_size)
+            self.spill_file.write(data)
+            records.append((self.spill_size, len(data), image.mode, image.size))
+            self.spill_size += len(data)
+        glyph.spilled = tuple(records)
+        glyph.image, glyph.patch = None, (glyph.patch[0], None, glyph.patch[2])
+
+    def load(self, glyph: Glyph) -> None:
+        """
+        Brings the data of a glyph back into memory if it was moved to the spill file.
+
+        :param glyph: The glyph.
+        """
+        if glyph.spilled is None:
+            return
+        images = []
+        for offset, length, mode, size in glyph.spilled:
+            self.spill_file.seek(offset)
+            images.append(Image.frombytes(mode, size, self.spill_file.read(length)))
+        glyph.image, glyph.patch = images[0], (glyph.patch[0], images[1], glyph.patch[2])
+        glyph.spilled = None
+        self.size += glyph.get_size()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get the memory statistics, e.g. for checking whether the memory limit is large enough.
+
+        :return: A dictionary of glyph count, glyphs that can be removed, glyphs moved out of memory,
+                 memory taken in bytes, memory limit, spill file size in bytes and canvas size in bytes.
+        """
+        buffer = self.canvas.buffer
+        return {
+            'glyphs': len(self.glyphs),
+            'undoable': self.undoable,
+            'kept': self.kept,
+            'size': self.size,
+            'limit': self.limit,
+            'spill_size': self.spill_size,
+            'canvas_size': 0 if buffer is None else buffer.width * buffer.height * 4,
+        }
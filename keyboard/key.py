@@ -1,18 +1,74 @@
-from io import BytesIO
+from concurrent.futures import Executor
 from math import ceil, sqrt
-from os.path import isfile
-from typing import Callable, Union
+from os.path import getmtime
+from typing import Callable, Hashable, Optional, Union, TYPE_CHECKING
 
 from PIL import Image
 from cocos.sprite import Sprite
-from pyglet.image import load
+from pyglet.image import ImageData
 
+from bundle import asset_bundle
+from .assets import asset_index
+from .cache import asset_cache, disk_cache, is_cacheable, persistent_key, processing_key
+
+if TYPE_CHECKING:
+    from .atlas import KeyAtlas
+
+
+def unprocessed(image: Image.Image) -> Image.Image:
+    return image
+
+
+unprocessed.version = 'unprocessed'  # see persistent_key
+
+
+def to_image_data(image: Image.Image) -> ImageData:
+    """
+    Converts a PIL image to pyglet image data directly, without encoding it to PNG and decoding it back.
+
+    :param image: The image to convert.
+    :return: The image data, ready to be used for sprites.
+    """
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    # pyglet expects rows bottom to top; flipping here is much faster than letting pyglet handle a negative pitch
+    data = image.transpose(Image.FLIP_TOP_BOTTOM).tobytes()
+    return ImageData(image.width, image.height, 'RGBA', data, pitch=image.width * 4)
+
+
+def asset_exists(path: str) -> bool:
+    return path in asset_bundle or asset_index.exists(path)
+
+
+def get_asset_mtime(path: str) -> float:
+    mtime = asset_bundle.get_mtime(path)
+    if mtime is None:
+        mtime = asset_index.get_mtime(path)
+    return getmtime(path) if mtime is None else mtime
+
+
+def open_asset(path: str) -> Image.Image:
+    """
+    Opens an asset from the asset bundle (see ``bundle.AssetBundle``), or from the asset file if it's not bundled.
+
+    :param path: The asset path, e.g. ``keyboards/assets/util/none.png``.
+    :return: The asset image, which should not be modified in place.
+    """
+    image = asset_bundle.open(path)
+    return Image.open(path) if image is None else image
+
+
+class KeyAsset:
+    """
+    The image of a key before preprocessing: a single asset, or a grid of assets for previews.
+
+    Loading it only involves PIL and the asset caches, so unlike creating a ``Key``, it can be done on any thread.
+    The asset itself is only decoded once it's needed, since rendered keys are usually found in the disk cache.
+    """
 
-class Key(Sprite):
     def __init__(self, name: Union[None, str, list[Union[str, list[str]]]] = None, folder: str = 'util',
                  size: Union[None, int, float, tuple[Union[int, float], Union[int, float]]] = None,
-                 preprocess: Callable[[Image.Image], Image.Image] = lambda x: x,
-                 resample: int = Image.BILINEAR, **kwargs) -> None:
+                 resample: int = Image.BILINEAR) -> None:
         self.empty = False
         if name in (None, []):
             self.empty = True
@@ -20,6 +76,9 @@ class Key(Sprite):
             folder = 'util'
         self.name = name
         self.folder = folder
+        self.size = size
+        self.resample = resample
+        self.image = None
         if type(name) == list:
             if type(name[0]) == list:
                 grid_height = len(name)
@@ -32,39 +91,103 @@ class Key(Sprite):
             if size is None:
                 size = 64
             if type(size) in (int, float):
-                img_size = round(size * grid_width), round(size * grid_height)
+                self.grid_size = round(size * grid_width), round(size * grid_height)
                 size = (size, size)
             else:
-                img_size = round(size[0] * grid_width), round(size[1] * grid_height)
-            self.base_image = Image.new(mode='RGBA', size=img_size, color=(0, 0, 0, 0))
-            for i, name_part in enumerate(new_name):
-                image_part = Image.open(self.get_path(name_part))
-                image_part = image_part.resize((
-                    round(min(image_part.width / image_part.height, 1) * size[0]),
-                    round(min(image_part.height / image_part.width, 1) * size[1])
-                ), resample=resample)
-                x, y = i % grid_width, i // grid_width
-                self.base_image.paste(image_part, (
-                    round(image_part.width * x + (size[0] - image_part.width) * (x + 0.5)),
-                    round(image_part.height * y + (size[1] - image_part.height) * (y + 0.5))
-                ))
-            self.rename(new_name)
+                self.grid_size = round(size[0] * grid_width), round(size[1] * grid_height)
+            paths = tuple(self.get_path(name_part) for name_part in new_name)
+            self.base_key = (paths, tuple(map(get_asset_mtime, paths)), grid_width, self.grid_size, size, resample)
+            self.loader = lambda: self.load_grid(paths, grid_width, self.grid_size, size, resample)
+            self.name = new_name
         else:
-            self.base_image = Image.open(self.get_path())
-            if size is None:
-                img_size = self.base_image.width, self.base_image.height
-            elif type(size) in (int, float):
-                img_size = (round(size / self.base_image.height * self.base_image.width), round(size))
-            else:
-                img_size = (round(size[0]), round(size[1]))
-        self.base_image = self.base_image.convert('RGBA')
-        self.base_image.format = 'PNG'
-        image_buffer = preprocess(self.base_image) if not self.empty else self.base_image
-        image_buffer = image_buffer.resize(img_size, resample=resample)
-        data_buffer = BytesIO()
-        image_buffer.save(data_buffer, format='png')
-        data_buffer.seek(0)
-        super().__init__(load('temp.png', file=data_buffer), **kwargs)
+            path = self.get_path()
+            self.grid_size = None
+            self.base_key = (path, get_asset_mtime(path))  # edited assets get picked up on reload
+            self.loader = lambda: open_asset(path).convert('RGBA')
+
+    @property
+    def base_image(self) -> Image.Image:
+        if self.image is None:
+            self.image = asset_cache.load(self.base_key, self.loader)
+            self.image.format = 'PNG'
+        return self.image
+
+    @property
+    def img_size(self) -> tuple[int, int]:
+        if self.grid_size is not None:
+            return self.grid_size
+        if self.size is None:
+            return self.base_image.width, self.base_image.height
+        if type(self.size) in (int, float):
+            return round(self.size / self.base_image.height * self.base_image.width), round(self.size)
+        return round(self.size[0]), round(self.size[1])
+
+    def render(self, preprocess: Callable[[Image.Image], Image.Image] = unprocessed) -> Image.Image:
+        """
+        Get the final key image: the preprocessed base image, resized to the requested size.
+
+        Unless ``preprocess`` is ``unprocessed`` (or the key is empty), this should be called on the main thread,
+        since preprocessing effects may look at the current state of the keyboard.
+
+        :param preprocess: The preprocessing function.
+        :return: The key image.
+        """
+        if self.empty:
+            preprocess = unprocessed
+
+        def create() -> Image.Image:
+            stable_key = persistent_key(preprocess)
+            if stable_key is None:
+                return preprocess(self.base_image).resize(self.img_size, resample=self.resample)
+            return disk_cache.load(
+                self.get_disk_key(stable_key),
+                lambda: preprocess(self.base_image).resize(self.img_size, resample=self.resample)
+            )
+
+        if not is_cacheable(preprocess):
+            return create()
+        return asset_cache.load((self.base_key, self.size, self.resample, processing_key(preprocess)), create)
+
+    def get_disk_key(self, stable_key: Hashable) -> tuple:
+        """
+        Get the disk cache key of the rendered key.
+
+        :param stable_key: The ``persistent_key`` of the preprocessing function.
+        :return: The cache key.
+        """
+        return self.base_key, self.size, self.resample, stable_key
+
+    def is_rendered(self, stable_key: Optional[Hashable]) -> bool:
+        """
+        Check if the rendered key is in the disk cache, so that ``render`` won't need the base image.
+
+        :param stable_key: The ``persistent_key`` of the preprocessing function, or None if it isn't stored on disk.
+        :return: True if the rendered key is in the disk cache, False otherwise.
+        """
+        return stable_key is not None and disk_cache.contains(self.get_disk_key(stable_key))
+
+    @staticmethod
+    def load_grid(paths: tuple[str, ...], grid_width: int, img_size: tuple[int, int],
+                  size: tuple[Union[int, float], Union[int, float]], resample: int) -> Image.Image:
+        grid_image = Image.new(mode='RGBA', size=img_size, color=(0, 0, 0, 0))
+        for i, path in enumerate(paths):
+            image_part = asset_cache.load(
+                (path, get_asset_mtime(path), size, resample), lambda: KeyAsset.load_part(path, size, resample)
+            )
+            x, y = i % grid_width, i // grid_width
+            grid_image.paste(image_part, (
+                round(image_part.width * x + (size[0] - image_part.width) * (x + 0.5)),
+                round(image_part.height * y + (size[1] - image_part.height) * (y + 0.5))
+            ))
+        return grid_image
+
+    @staticmethod
+    def load_part(path: str, size: tuple[Union[int, float], Union[int, float]], resample: int) -> Image.Image:
+        image_part = open_asset(path)
+        return image_part.resize((
+            round(min(image_part.width / image_part.height, 1) * size[0]),
+            round(min(image_part.height / image_part.width, 1) * size[1])
+        ), resample=resample)
 
     def get_path(self, name: str = None, folder: str = None) -> str:
         if name is None:
@@ -72,13 +195,77 @@ class Key(Sprite):
         if folder is None:
             folder = self.folder
         path_string = 'keyboards/assets/{}/{}.png'
-        if not isfile(path_string.format(folder, name)):
+        if not asset_exists(path_string.format(folder, name)):
             name = name.split(':', 1)[0]
-        if not isfile(path_string.format(folder, name)):
+        if not asset_exists(path_string.format(folder, name)):
             self.empty = True
             folder, name = 'util', 'none'
         return path_string.format(folder, name)
 
+
+def load_assets(
+        keys: list[tuple], preprocess: Callable[[Image.Image], Image.Image] = unprocessed,
+        executor: Optional[Executor] = None, stable_keys: Optional[list[Optional[Hashable]]] = None
+) -> list[KeyAsset]:
+    """
+    Loads the assets for several keys at once, decoding and resizing them on the executor's threads if one is given.
+
+    The result is the same with or without an executor.
+
+    :param keys: A list of ``KeyAsset`` argument tuples, i.e. (name, folder, size, resample).
+    :param preprocess: The preprocessing function the keys will be rendered with. If it's ``unprocessed``,
+                       the final key images are rendered in advance as well.
+    :param executor: The executor to use, or None to load everything on the calling thread.
+    :param stable_keys: The ``persistent_key`` of ``preprocess`` for every key, taken in the keyboard state
+                        the key will be rendered in. Assets are only decoded in advance if their rendered key
+                        isn't in the disk cache under it. Default: decode every asset in advance.
+    :return: The loaded assets, in the same order as ``keys``.
+    """
+    def load(args: tuple, stable_key: Optional[Hashable]) -> KeyAsset:
+        asset = KeyAsset(*args)
+        if preprocess is unprocessed or asset.empty:
+            asset.render()  # nothing in here depends on the keyboard state, so it can be cached right away
+        elif not asset.is_rendered(stable_key):
+            asset.base_image  # decoded here, so that render() on the main thread only has to preprocess it
+        return asset
+
+    if stable_keys is None:
+        stable_keys = [None] * len(keys)
+    if executor is None or len(keys) < 2:
+        return [load(args, stable_key) for args, stable_key in zip(keys, stable_keys)]
+    return list(executor.map(load, keys, stable_keys))
+
+
+class Key(Sprite):
+    def __init__(self, name: Union[None, str, list[Union[str, list[str]]]] = None, folder: str = 'util',
+                 size: Union[None, int, float, tuple[Union[int, float], Union[int, float]]] = None,
+                 preprocess: Callable[[Image.Image], Image.Image] = unprocessed,
+                 resample: int = Image.BILINEAR, atlas: Optional['KeyAtlas'] = None,
+                 asset: Optional[KeyAsset] = None, **kwargs) -> None:
+        if asset is None:
+            asset = KeyAsset(name, folder, size, resample)
+        self.empty = asset.empty
+        self.name = asset.name
+        self.folder = asset.folder
+        self.asset = asset
+        self.rename(asset.name)
+        self.key_image = asset.render(preprocess)
+        self.atlas = atlas
+        self.atlas_generation = None if atlas is None else atlas.generation
+        super().__init__(to_image_data(self.key_image) if atlas is None else atlas.add(self.key_image), **kwargs)
+
+    @property
+    def base_image(self) -> Image.Image:
+        return self.asset.base_image
+
+    def release(self) -> None:
+        """
+        Releases the key's atlas region. Should be called when the key is removed from the board for good.
+        """
+        if self.atlas is not None:
+            self.atlas.release(self.key_image, self.atlas_generation)
+            self.atlas = None
+
     def is_empty(self) -> bool:
         return self.empty
 
@@ -1,22 +1,25 @@
-from io import BytesIO
-from itertools import product
+from functools import partial
+from itertools import chain, product
 from math import lcm
 from os.path import abspath, relpath, splitext
-from typing import Optional, Union
+from typing import Callable, Iterable, Optional, Union
 
-import win32clipboard as clp
 from PIL import Image
 from cocos.batch import BatchNode
 from cocos.director import director
 from cocos.layer import ColorLayer
 from cocos.rect import Rect
 from cocos.sprite import Sprite
-from pyglet.image import load
 from pyglet.window import key, mouse
 
 import pyperclip
-from .key import Key
+from .assets import asset_index
+from .atlas import KeyAtlas
+from .cache import persistent_key, processing_key
+from .document import Glyph
+from .key import Key, KeyAsset, load_assets, to_image_data, unprocessed
 from .manager import manager, OutputMode, EDIT_VARS
+from .output import output_writer
 
 
 class Keyboard(ColorLayer):
@@ -106,6 +109,8 @@ class Keyboard(ColorLayer):
         self.current_key_is_pressed = False
         self.board_sprites = list()
         self.key_sprites = list()
+        self.atlas_size = getattr(module, 'atlas_size', manager.atlas_size)
+        self.atlas = KeyAtlas(self.atlas_size) if self.atlas_size > 0 else None
         self.board = BatchNode()
         self.screen = Key(
             'cell',
@@ -156,12 +161,14 @@ class Keyboard(ColorLayer):
         self.overlay.add(self.pressed_key_back)
         self.overlay.add(self.cursor)
 
-        for row in range(self.board_height):
-            self.board_sprites = [
-                [Key('cell', size=self.key_size) for _ in range(self.board_width)]
-                for _ in range(self.board_height)
-            ]
-            self.key_sprites = [[Key() for _ in range(self.board_width)] for _ in range(self.board_height)]
+        self.board_sprites = [
+            [Key('cell', size=self.key_size, atlas=self.atlas) for _ in range(self.board_width)]
+            for _ in range(self.board_height)
+        ]
+        self.empty_key = Key()
+        self.key_sprites = self.get_empty_grid()
+        self.layout_pools = dict()
+        self.displayed_layout = None
 
         for row, col in product(range(self.board_height), range(self.board_width)):
             self.board_sprites[row][col].position = self.get_screen_position((row, col))
@@ -175,48 +182,175 @@ class Keyboard(ColorLayer):
     def update_layout(self) -> None:
         """
         Updates the layout on screen according to the ``self.layouts`` variable.
+
+        Layouts that were displayed before are restored from their sprite pools,
+        and only keys that would look different now are rendered again.
+        """
+        asset_index.refresh()
+        if self.displayed_layout != self.current_layout:
+            self.stash_layout()
+            self.key_sprites = self.layout_pools.pop(self.current_layout, self.key_sprites)
+            self.displayed_layout = self.current_layout
+        if self.atlas is not None and self.atlas.waste > 0.5:
+            self.repack()
+        self.update_cells()
+        manager.touch_layout(self)
+        director.window.set_caption(f'Keyboard: {self.name}/{self.current_layout}')
+        self.loaded = True
+
+    def update_cells(self, cells: Optional[Iterable[tuple[int, int]]] = None) -> int:
+        """
+        Updates the keys in the given cells of the displayed layout, rendering only the ones
+        whose layout entry, preview target or preprocessing state changed since they were last rendered.
+
+        The assets of the keys that have to be rendered again are decoded and resized on the manager's
+        decoding threads (see ``KeyboardManager.get_executor``), while preprocessing and texture creation
+        stay on the main thread.
+
+        :param cells: The (row, col) layout coordinates of the cells to check. Default: every cell on the board.
+        :return: The number of keys that had to be rendered again.
         """
-        key_preprocess = self.preprocess if self.preprocess_keys else lambda x: x
+        if cells is None:
+            cells = product(range(self.board_height), range(self.board_width))
+        resolved = {pos: self.resolve_key(pos) for pos in cells}
+        stale = [pos for pos, (_, _, _, signature) in resolved.items() if not self.is_current(pos, signature)]
+        preprocess = self.get_key_preprocess()
+        stable_keys = []
+        for pos in stale:
+            self.set_current_key(pos, resolved[pos][0])  # see resolve_key
+            stable_keys.append(persistent_key(preprocess))
+        assets = load_assets(
+            [(resolved[pos][1], resolved[pos][2], self.get_max_size(), self.resample) for pos in stale],
+            preprocess, manager.get_executor(), stable_keys
+        )
+        assets = dict(zip(stale, assets))
+        return sum(self.place_key(pos, *resolved[pos], asset=assets.get(pos, None)) for pos in resolved)
+
+    def get_key_preprocess(self) -> Callable[[Image.Image], Image.Image]:
+        return self.preprocess if self.preprocess_keys else unprocessed
+
+    def get_max_size(self) -> Union[int, float]:
         if self.resample == 0 and not self.use_old_nearest:
-            max_size = lcm(self.key_size, self.char_size)
+            return lcm(self.key_size, self.char_size)
+        return max(self.key_size * self.pressed_key_scale, self.char_size)
+
+    def resolve_key(self, pos: tuple[int, int]) -> tuple[str, Union[str, list], str, tuple]:
+        """
+        Find out what a key should look like according to the ``self.layouts`` variable.
+
+        :param pos: A tuple of (row, col) layout coordinates.
+        :return: A tuple of (layout entry, asset name, asset folder, signature),
+                 where the signature is what the sprite in this cell has to match to be reused.
+        """
+        row, col = pos
+        old_name = self.layouts[self.current_layout][row][col]
+        asset_folder = self.asset_folder
+        new_name = old_name
+        if type(old_name) is str:
+            if old_name[:1] == '/':
+                key_name = old_name[1:]
+                layout_name = key_name.split(':', 1)[0]
+                keyboard_name = layout_name.split('/', 1)[0]
+                for name in key_name, layout_name, keyboard_name:
+                    if name in manager.preview_keys:
+                        asset_folder = manager.get_asset_folder(keyboard_name) or self.asset_folder
+                        new_name = manager.preview_keys[name]
+                        break
+            if old_name[:2] == '~/':
+                key_name = old_name[2:]
+                layout_name = key_name.split(':', 1)[0]
+                for name in key_name, layout_name:
+                    if name in self.preview_keys:
+                        new_name = self.preview_keys[name]
+                        break
+        self.set_current_key(pos, old_name)
+        signature = (old_name, repr(new_name), asset_folder, self.get_max_size(),
+                     processing_key(self.get_key_preprocess()))
+        return old_name, new_name, asset_folder, signature
+
+    def set_current_key(self, pos: tuple[int, int], name: str) -> None:
+        # preprocessing effects look at the current key, so it has to be set up before the key is rendered
+        self.key_sprites[pos[0]][pos[1]].rename(name)
+        self.current_key_position = pos
+        self.current_key_is_pressed = False
+
+    def is_current(self, pos: tuple[int, int], signature: tuple) -> bool:
+        old_sprite = self.key_sprites[pos[0]][pos[1]]
+        return old_sprite is not self.empty_key and getattr(old_sprite, 'signature', None) == signature
+
+    def place_key(self, pos: tuple[int, int], old_name: str, new_name: Union[str, list], asset_folder: str,
+                  signature: tuple, asset: Optional[KeyAsset] = None) -> bool:
+        """
+        Puts a key on the board, rendering it again unless the sprite that's already there matches ``signature``.
+
+        :param pos: A tuple of (row, col) layout coordinates.
+        :param old_name: The layout entry.
+        :param new_name: The asset name.
+        :param asset_folder: The asset folder.
+        :param signature: The signature returned by ``resolve_key``.
+        :param asset: The key asset, if it was already loaded. Default: load it when needed.
+        :return: True if the key had to be rendered again, False if the existing sprite was kept.
+        """
+        row, col = pos
+        old_sprite = self.key_sprites[row][col]
+        if self.is_current(pos, signature):
+            new_sprite = old_sprite  # nothing changed, reuse the sprite we already have
         else:
-            max_size = max(self.key_size * self.pressed_key_scale, self.char_size)
-        for row, col in product(range(self.board_height), range(self.board_width)):
-            if self.key_sprites[row][col].parent == self.keys:
-                self.keys.remove(self.key_sprites[row][col])
-            old_name = self.layouts[self.current_layout][row][col]
-            asset_folder = self.asset_folder
-            new_name = old_name
-            if type(old_name) is str:
-                if old_name[:1] == '/':
-                    key_name = old_name[1:]
-                    layout_name = key_name.split(':', 1)[0]
-                    keyboard_name = layout_name.split('/', 1)[0]
-                    for name in key_name, layout_name, keyboard_name:
-                        if name in manager.preview_keys:
-                            _, keyboard = manager.get_keyboard(keyboard_name)
-                            asset_folder = keyboard.asset_folder if keyboard is not None else self.asset_folder
-                            new_name = manager.preview_keys[name]
-                            break
-                if old_name[:2] == '~/':
-                    key_name = old_name[2:]
-                    layout_name = key_name.split(':', 1)[0]
-                    for name in key_name, layout_name:
-                        if name in self.preview_keys:
-                            new_name = self.preview_keys[name]
-                            break
-            self.key_sprites[row][col].rename(old_name)
-            self.current_key_position = (row, col)
-            self.current_key_is_pressed = False
-            new_sprite = Key(new_name, asset_folder, size=max_size, preprocess=key_preprocess, resample=self.resample)
+            self.set_current_key(pos, old_name)
+            new_sprite = Key(new_name, asset_folder, size=self.get_max_size(), preprocess=self.get_key_preprocess(),
+                             resample=self.resample, atlas=self.atlas, asset=asset)
             new_sprite.rename(old_name)
-            new_sprite.position = self.get_screen_position(self.current_key_position)
+            new_sprite.signature = signature
+            new_sprite.position = self.get_screen_position(pos)
             new_sprite.resize(self.key_size)
-            self.board_sprites[row][col].opacity = 0 if new_sprite.is_empty() else self.key_color[3]
-            self.key_sprites[row][col] = new_sprite
-            self.keys.add(self.key_sprites[row][col])
-        director.window.set_caption(f'Keyboard: {self.name}/{self.current_layout}')
-        self.loaded = True
+            if old_sprite in self.keys:
+                self.keys.remove(old_sprite)
+            old_sprite.release()
+        self.board_sprites[row][col].opacity = 0 if new_sprite.is_empty() else self.key_color[3]
+        self.key_sprites[row][col] = new_sprite
+        if new_sprite not in self.keys and new_sprite not in self.active_key:
+            self.keys.add(new_sprite)
+        return new_sprite is not old_sprite
+
+    def stash_layout(self) -> None:
+        """
+        Moves the keys of the displayed layout off the board and into its sprite pool, so that switching back to it
+        doesn't have to render them again.
+        """
+        if self.displayed_layout is None:
+            return
+        displayed = set(self.keys.get_children())
+        for sprite in chain.from_iterable(self.key_sprites):
+            if sprite in displayed:
+                self.keys.remove(sprite)
+        self.layout_pools[self.displayed_layout] = self.key_sprites
+        self.key_sprites = self.get_empty_grid()
+        self.displayed_layout = None
+
+    def drop_layout(self, layout: str) -> None:
+        """
+        Releases the sprites kept for a layout, so that it has to be rendered from scratch the next time it's shown.
+
+        :param layout: The layout name.
+        """
+        if layout == self.displayed_layout:
+            self.stash_layout()
+        for sprite in chain.from_iterable(self.layout_pools.pop(layout, [])):
+            sprite.release()
+
+    def repack(self) -> None:
+        """
+        Drops all sprite pools and starts a new atlas, so that the keys rendered next are packed without gaps.
+        """
+        for layout in list(self.layout_pools):
+            manager.pooled_layouts.pop((self.name, layout), None)
+            self.drop_layout(layout)
+        for sprite in chain.from_iterable(self.key_sprites):
+            sprite.signature = None  # the displayed keys have to be rendered again as well
+        self.atlas.reset()
+
+    def get_empty_grid(self) -> list[list[Key]]:
+        return [[self.empty_key for _ in range(self.board_width)] for _ in range(self.board_height)]
 
     @property
     def is_loaded(self) -> bool:
@@ -357,8 +491,7 @@ class Keyboard(ColorLayer):
 
         :param pos: A tuple of (row, col) layout coordinates.
         """
-        manager.image_history.append((manager.image_buffer, manager.next_key_position.copy()))
-        manager.text_history.append(manager.text_buffer)
+        old_position = manager.next_key_position.copy()
         pressed_key = self.get_key(pos)
         if pressed_key.name == self.enter_key:
             key_image = Key().base_image
@@ -371,29 +504,13 @@ class Keyboard(ColorLayer):
         key_image.format = 'PNG'
         key_image = self.preprocess(key_image)
         if key_image is None:
-            manager.image_buffer, manager.next_key_position = manager.image_history.pop()
-            manager.text_buffer = manager.text_history.pop()
+            manager.next_key_position = old_position
         else:
             if pressed_key.name == self.enter_key:
                 manager.next_key_position = [0, manager.next_key_position[1] + key_image.height]
-            if manager.image_buffer is None:
-                new_buffer = Image.new(
-                    mode='RGBA',
-                    size=(manager.next_key_position[0] + key_image.width,
-                          manager.next_key_position[1] + key_image.height),
-                    color=(0, 0, 0, 0)
-                )
-            else:
-                new_buffer = Image.new(
-                    mode='RGBA',
-                    size=(max(manager.image_buffer.width, manager.next_key_position[0] + key_image.width),
-                          max(manager.image_buffer.height, manager.next_key_position[1] + key_image.height)),
-                    color=(0, 0, 0, 0)
-                )
-                new_buffer.paste(manager.image_buffer)
-            # noinspection PyTypeChecker
-            new_buffer.paste(key_image, tuple(manager.next_key_position))
-            manager.image_buffer = new_buffer
+            manager.document.append(Glyph(
+                key_image, tuple(manager.next_key_position), tuple(old_position), text_length=len(manager.text_buffer)
+            ))
             if pressed_key.name == self.enter_key:
                 manager.text_buffer += '\n'
             else:
@@ -408,14 +525,19 @@ class Keyboard(ColorLayer):
         if manager.screen_image is not None and manager.screen_image.parent == self:
             self.remove(manager.screen_image)
         manager.screen_image = None
+        manager.output_image = None
         self.cursor.position = (self.border_width, self.window_height - self.border_width)
         self.cursor.resize(min(self.char_size, self.screen.height))
+        output_writer.cancel()  # so that images that are still being written don't end up in the clipboard
+        manager.clipboard_sink.cancel()
         pyperclip.copy('')
 
     def update_image(self) -> None:
         """
         Updates the image on the screen and the output files to match ``manager.image_buffer``,
         and copies the file in the current output mode to the clipboard if the buffer isn't empty.
+        The files are written and copied in the background (see ``OutputWriter``);
+        use ``output_writer.flush()`` to wait for them.
 
         Note that the postprocessing function should be called regardless of whether the buffer is empty.
         """
@@ -427,11 +549,7 @@ class Keyboard(ColorLayer):
             self.clear_screen()
             return
 
-        data_buffer = BytesIO()
-        (post_processed_image if self.postprocess_screen else manager.image_buffer).save(data_buffer, format='png')
-        data_buffer.seek(0)
-
-        screen_image = load('temp.png', file=data_buffer)
+        screen_image = to_image_data(post_processed_image if self.postprocess_screen else manager.image_buffer)
         if manager.screen_image is not None and manager.screen_image.parent == self:
             self.remove(manager.screen_image)
         manager.screen_image = Sprite(
@@ -455,32 +573,76 @@ class Keyboard(ColorLayer):
         )
         self.cursor.resize(self.char_size * manager.screen_image.scale)
 
+        manager.output_image = post_processed_image.copy()  # copied, effects may keep drawing on it
+        self.write_output(list(OutputMode) if manager.write_all_outputs else [manager.output_mode])
+
+    def get_output_image(self, mode: OutputMode, image: Image.Image) -> Image.Image:
+        """
+        Get the output image of an output mode.
+
+        :param mode: The output mode.
+        :param image: The postprocessed image.
+        :return: The output image.
+        """
+        if mode == OutputMode.TRANSPARENT:
+            return image  # use this one if you want to edit in a background or something
         background_image = Image.new(
             mode='RGBA',
-            size=(post_processed_image.width, post_processed_image.height),
+            size=(image.width, image.height),
             color=self.image_color  # for anyone who can't use transparency for some weird tech-related reason
         )
-        background_image.alpha_composite(post_processed_image)
-        opaque_image = background_image.copy()
-        opaque_image.mode = 'RGB'
+        background_image.alpha_composite(image)
+        if mode == OutputMode.OPAQUE:
+            background_image.mode = 'RGB'  # or use this one if you're having transparency issues
+        return background_image  # in case my clipboard shenanigans don't work, use the file itself
+
+    def write_output(self, modes: Optional[Iterable[OutputMode]] = None, copy: bool = True) -> None:
+        """
+        Writes the output files of the given output modes for the last image shown on the screen.
 
-        path = 'image_regular.png'
-        background_image.save(path)   # in case my clipboard shenanigans don't work, use the file itself
+        Unless ``write_all_outputs`` is set, only the file of the current output mode is kept up to date
+        while typing, so anything that needs the other files should ask for them here.
 
-        path = 'image_opaque.png'
-        opaque_image.save(path)   # or use this file if you're having transparency issues
+        :param modes: The output modes. Default: all of them.
+        :param copy: Whether to copy the file of the current output mode to the clipboard once it's written.
+        """
+        if manager.output_image is None:
+            return
+        modes = list(OutputMode) if modes is None else list(modes)
+        images = {
+            manager.get_output_path(mode): (self.get_output_image(mode, manager.output_image), manager.encoders[mode])
+            for mode in modes
+        }
+        callback = None
+        if copy and manager.output_mode in modes:
+            copied_image = images[manager.get_output_path(manager.output_mode)][0]
+            callback = partial(self.copy_image, image=copied_image)
+        # the files are written in the background; the clipboard is updated once they're there
+        output_writer.submit(images, callback)
 
-        path = 'image_transparent.png'
-        post_processed_image.save(path)  # or this one if you want to edit in a background or something
+    @staticmethod
+    def copy_image(written: dict[str, memoryview], is_current: Callable[[], bool], image: Image.Image) -> None:
+        """
+        Copies the file in the current output mode to the clipboard (see ``keyboard.clipboard.ClipboardSink``).
 
-        copy_path = abspath(f'image_{manager.output_mode.value}.png').encode('utf-16-le') + b'\0'
-        copy_file = open(f'image_{manager.output_mode.value}.png', 'rb')
+        The clipboard gets the file contents, unless they have to be encoded differently for it
+        (see ``KeyboardManager.get_clipboard_encoder``).
 
-        clp.OpenClipboard()
-        clp.EmptyClipboard()  # You may have seen this on https://stackoverflow.com/q/66845295/17391024. You're welcome.
-        clp.SetClipboardData(clp.RegisterClipboardFormat('FileNameW'), copy_path)         # works for Discord
-        clp.SetClipboardData(clp.RegisterClipboardFormat('image/png'), copy_file.read())  # works for PDN & TG
-        clp.CloseClipboard()
+        :param written: A dictionary of the written file paths and their contents.
+        :param is_current: A function that tells whether the files are still the latest ones,
+                           i.e. the screen wasn't cleared and no newer images were submitted since.
+        :param image: The image in the file, in case it has to be encoded differently for the clipboard.
+        """
+        path = manager.get_output_path(manager.output_mode)
+        if path not in written:
+            return
+        encoder = manager.get_clipboard_encoder(manager.output_mode)
+        data = written[path]
+        if encoder is not manager.encoders[manager.output_mode]:
+            if not is_current():
+                return  # don't bother encoding
+            data = encoder.encode(image)
+        manager.clipboard_sink.send(abspath(path), data, encoder.mime_type, is_valid=is_current)
 
     def map_layouts(self) -> None:
         self.mapping = dict()
@@ -626,16 +788,19 @@ class Keyboard(ColorLayer):
                         self.update_layout()
                     return
                 if key_name == self.backspace_key:
-                    if len(manager.image_history) == 0:
+                    if len(manager.document) == 0:
                         return
                     if buttons & mouse.LEFT and not modifiers & key.MOD_SHIFT:
-                        manager.image_buffer, manager.next_key_position = manager.image_history.pop()
-                        manager.text_buffer = manager.text_history.pop()
+                        if manager.document.undoable == 0:
+                            return  # the rest of the history was dropped to stay within history_size
+                        glyph = manager.document.pop()
+                        manager.next_key_position = list(glyph.cursor)
+                        manager.text_buffer = manager.text_buffer[:glyph.text_length]
                     elif buttons & mouse.RIGHT or (buttons & mouse.LEFT and modifiers & key.MOD_SHIFT):
-                        manager.image_buffer, manager.next_key_position = manager.image_history[0]
-                        manager.image_history.clear()
-                        manager.text_buffer = manager.text_history[0]
-                        manager.text_history.clear()
+                        glyph = manager.document.glyphs[0]
+                        manager.next_key_position = list(glyph.cursor)
+                        manager.text_buffer = manager.text_buffer[:glyph.text_length]
+                        manager.document.clear()
                     self.update_image()
                 else:
                     self.press_key(current_pos)
@@ -1,17 +1,28 @@
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser, Error
 from enum import Enum
 from glob import iglob
 from importlib import import_module, invalidate_caches, reload
-from traceback import print_exc
 from typing import Callable, Optional, TypeVar, TYPE_CHECKING
 
+import pyglet
+import pyperclip
 from PIL import Image
 from PIL.ImageColor import getrgb
 from cocos.cocosnode import CocosNode
 from cocos.director import director
 from cocos.scene import Scene
 
+from bundle import asset_bundle
+from .assets import asset_index
+from .cache import asset_cache, disk_cache
+from .clipboard import get_clipboard_sink
+from .document import Document
+from .output import ENCODER_PROFILES, EncoderProfile, output_writer
+from .pipeline import build_pipeline
+
 if TYPE_CHECKING:
     from keyboard.keyboard import Keyboard
 
@@ -47,11 +58,12 @@ class KeyboardManager(CocosNode):
             super().__init__()
             director.window.remove_handlers(director._default_event_handler)
         self.screen_image = None
-        self.image_buffer = None
-        self.image_history = []
+        self.output_image = None
+        self.document = Document()
         self.text_buffer = ''
-        self.text_history = []
         self.next_key_position = [0, 0]
+        asset_bundle.refresh()
+        asset_index.clear()
         self.config = ConfigParser()
         self.config.read('config.ini')
         try:
@@ -91,7 +103,45 @@ class KeyboardManager(CocosNode):
             self.keyboard_modules, self.keyboard_edit_modules, self.postprocess = dict(), dict(), lambda x: x
         self.preprocess_keys = self.load_value('preprocess_keys', False)
         self.postprocess_screen = self.load_value('postprocess_screen', True)
+        self.asset_cache_size = self.load_value('asset_cache_size', 128)  # in megabytes
+        asset_cache.limit = self.asset_cache_size * 1024 * 1024
+        self.disk_cache_folder = self.load_value('disk_cache_folder', 'cache')
+        self.disk_cache_size = self.load_value('disk_cache_size', 64)  # in megabytes, 0 disables the disk cache
+        if disk_cache.folder != self.disk_cache_folder:
+            disk_cache.folder = self.disk_cache_folder
+            disk_cache.files = None  # read the new folder when it's first used
+        disk_cache.limit = self.disk_cache_size * 1024 * 1024
+        self.atlas_size = self.load_value('atlas_size', 1024)  # 0 gives every key a texture of its own
+        self.layout_pool_size = self.load_value('layout_pool_size', 8)
+        self.prewarm_keyboards = self.load_value('prewarm_keyboards', False)
+        self.history_size = self.load_value('history_size', 64)  # in megabytes
+        self.history_spill = self.load_value('history_spill', True)  # False drops history over the limit instead
+        self.document.limit = self.history_size * 1024 * 1024
+        self.document.spill = self.history_spill
+        self.decode_threads = self.load_value('decode_threads', 4)  # 0 decodes everything on the main thread
+        if getattr(self, 'executor', None) is not None:
+            self.executor.shutdown(wait=False)  # recreated with the new thread count when it's needed
+        self.executor = None
+        self.pooled_layouts = OrderedDict()
         self.output_mode = OutputMode.REGULAR
+        self.write_all_outputs = self.load_value('write_all_outputs', False)  # True keeps every image_* file current
+        encoder = self.load_value('encoder', 'png')  # see keyboard.output.ENCODER_PROFILES
+        self.encoders = {
+            mode: self.get_encoder(self.load_value(f'encoder_{mode.value}', encoder)) for mode in OutputMode
+        }
+        clipboard_encoder = self.load_value('clipboard_encoder', '')  # empty: see get_clipboard_encoder
+        self.clipboard_encoder = self.get_encoder(clipboard_encoder) if clipboard_encoder else None
+        if getattr(self, 'clipboard_sink', None) is not None:
+            self.clipboard_sink.cancel()
+        self.clipboard_sink = get_clipboard_sink(self.load_value('clipboard_sink', 'auto'))  # see CLIPBOARD_SINKS
+        pyperclip.probe_clipboard_in_background()  # so that the first copy doesn't wait for it
+        # keeps one process owning the text clipboard instead of starting xclip & co. for every copy;
+        # off by default, since it's one more process to run and only helps with those backends
+        self.clipboard_helper = self.load_value('clipboard_helper', False)
+        if self.clipboard_helper and os.name != 'nt':  # the Windows clipboard doesn't need other processes anyway
+            pyperclip.enable_helper()
+        else:
+            pyperclip.disable_helper()
         self.keyboards = []
         self.keyboard_index = 0
         self.keyboard_dict = {}
@@ -108,7 +158,6 @@ class KeyboardManager(CocosNode):
         postprocess_names = self.load_value('postprocess', '').split(',')
         postprocess_names = [name.strip() for name in postprocess_names]
         self.postprocess_modules, self.postprocess = self.load_processing(postprocess_names, self.postprocess_modules)
-        from .keyboard import Keyboard
         for name in self.load_order:
             for module_dict, import_string in ((self.keyboard_modules, 'keyboards.{}'),
                                                (self.keyboard_edit_modules, 'keyboards.{}_edit')):
@@ -123,22 +172,33 @@ class KeyboardManager(CocosNode):
                 for var in EDIT_VARS:
                     if hasattr(self.keyboard_edit_modules[name], var):
                         setattr(self.keyboard_modules[name], var, getattr(self.keyboard_edit_modules[name], var))
-        self.keyboards = [Keyboard(name, self.keyboard_modules[name]) for name in self.load_order]
-        self.add(self.keyboards[self.keyboard_index])
-        self.keyboard_dict = {keyboard.name: (i, keyboard) for i, keyboard in enumerate(self.keyboards)}
-        self.keyboard_dict[None] = (-1, None)
+        # keyboards are only created once they're needed, see load_keyboard()
+        self.keyboards = [None for _ in self.load_order]
+        self.keyboard_dict = {name: i for i, name in enumerate(self.load_order)}
         self.load_preview_keys()
-        for keyboard in self.keyboards:
-            self.current_keyboard = keyboard
-            keyboard.update_layout()
         self.keyboard_index = 0
-        self.current_keyboard = self.keyboards[self.keyboard_index]
+        self.current_keyboard = self.load_keyboard(self.keyboard_index)
+        self.add(self.current_keyboard)
+        self.current_keyboard.update_layout()
         self.current_keyboard.update_image()
-        director.window.set_size(self.keyboards[self.keyboard_index].window_width,
-                                 self.keyboards[self.keyboard_index].window_height)
+        director.window.set_size(self.current_keyboard.window_width, self.current_keyboard.window_height)
         director.window.set_caption(f'Keyboard: /{self.current_keyboard.name}/{self.current_keyboard.current_layout}')
+        if self.prewarm_keyboards:
+            director.window.push_handlers(on_draw=self.on_first_draw)
         self.loaded = True
 
+    @property
+    def image_buffer(self) -> Optional[Image.Image]:
+        """
+        The typed image, or None if nothing was typed yet. It's drawn from ``document`` when it's requested,
+        so it should not be modified in place.
+        """
+        return self.document.get_image()
+
+    @image_buffer.setter
+    def image_buffer(self, image: Optional[Image.Image]) -> None:
+        self.document.set_image(image)
+
     @property
     def is_loaded(self) -> bool:
         """
@@ -194,43 +254,157 @@ class KeyboardManager(CocosNode):
             except ModuleNotFoundError:
                 pass
 
-        def processing_func(image: Optional[Image.Image]) -> Optional[Image.Image]:
-            for i in processing_list:
-                if image is not None:
-                    image.format = 'PNG'
-                try:
-                    image = getattr(processing_modules.get(i, None), 'process', lambda x: x)(image)
-                except Exception:
-                    print_exc()
-            return image
-
+        # effects that describe what they do are fused into as few passes as possible, see keyboard.pipeline
+        processing_func = build_pipeline([processing_modules.get(i, None) for i in processing_list])
+
+        def processing_state() -> tuple:
+            # Effects that depend on anything besides the image (e.g. the current key) describe it with state()
+            return tuple(getattr(processing_modules.get(i, None), 'state', lambda: None)() for i in processing_list)
+
+        processing_func.state = processing_state
+        # effects whose results can't be reused at all (e.g. random ones) opt out with cacheable = False
+        processing_func.cacheable = all(getattr(processing_modules.get(i, None), 'cacheable', True)
+                                        for i in processing_list)
+        # rendered keys are kept on disk between runs, so they have to be invalidated when any effect code changes
+        processing_func.version = (tuple(processing_list), tuple(sorted(
+            (path.replace(os.sep, '/'), os.path.getmtime(path)) for path in iglob('effects/*.py')
+        )))
         return processing_modules, processing_func
 
     def load_preview_keys(self) -> None:
-        for keyboard in self.keyboards:
-            default_preview = keyboard.preview_keys.get('default', None)
-            for k in keyboard.preview_keys:
+        # only module metadata is used here, so that keyboards don't have to be created just for their previews
+        for name in self.load_order:
+            module = self.keyboard_modules[name]
+            preview_keys = getattr(module, 'preview_keys', dict())
+            default_preview = preview_keys.get('default', None)
+            for k in preview_keys:
                 if k != 'default':
-                    self.preview_keys[f'{keyboard.name}/{k}'] = keyboard.preview_keys[k]
-            for k in keyboard.layouts:
-                if f'{keyboard.name}/{k}' not in self.preview_keys:
-                    self.preview_keys[f'{keyboard.name}/{k}'] = default_preview
-            if f'{keyboard.name}' not in self.preview_keys:
-                self.preview_keys[f'{keyboard.name}'] = default_preview
+                    self.preview_keys[f'{name}/{k}'] = preview_keys[k]
+            for k in (module.layouts if hasattr(module, 'layouts') else {'': [[]]}):
+                if f'{name}/{k}' not in self.preview_keys:
+                    self.preview_keys[f'{name}/{k}'] = default_preview
+            if f'{name}' not in self.preview_keys:
+                self.preview_keys[f'{name}'] = default_preview
+
+    def load_keyboard(self, index: int) -> 'Keyboard':
+        """
+        Get a keyboard by its index in the load order, creating it if it hasn't been created yet.
+
+        Note that a newly created keyboard has no keys on the board until its ``update_layout`` is called.
+
+        :param index: The keyboard index.
+        :return: The keyboard.
+        """
+        if self.keyboards[index] is None:
+            from .keyboard import Keyboard
+            name = self.load_order[index]
+            self.keyboards[index] = Keyboard(name, self.keyboard_modules[name])
+        return self.keyboards[index]
+
+    def on_first_draw(self) -> None:
+        director.window.remove_handlers(on_draw=self.on_first_draw)
+        pyglet.clock.schedule_once(self.prewarm, 0)
+
+    def prewarm(self, _dt: float = 0) -> None:
+        """
+        Creates and renders the next keyboard that hasn't been created yet, one keyboard per frame,
+        so that switching to it later is instant.
+        """
+        for index, keyboard in enumerate(self.keyboards):
+            if keyboard is None:
+                current_keyboard = self.current_keyboard
+                self.current_keyboard = self.load_keyboard(index)  # effects need to see the keyboard they render
+                self.current_keyboard.update_layout()
+                self.current_keyboard = current_keyboard
+                director.window.set_caption(f'Keyboard: {current_keyboard.name}/{current_keyboard.current_layout}')
+                pyglet.clock.schedule_once(self.prewarm, 0)
+                return
 
     @property
     def keyboard(self) -> 'Keyboard':
         return self.current_keyboard
 
-    def get_keyboard(self, name: str = '') -> Optional[int]:
-        return self.keyboard_dict.get(name, self.keyboard_dict[None])
+    def touch_layout(self, keyboard: 'Keyboard') -> None:
+        """
+        Marks the displayed layout of a keyboard as the most recently used one, and drops the sprites of
+        the least recently used layouts if more than ``layout_pool_size`` layouts are kept in memory.
+
+        :param keyboard: The keyboard that has just updated its layout.
+        """
+        self.pooled_layouts[(keyboard.name, keyboard.displayed_layout)] = keyboard
+        self.pooled_layouts.move_to_end((keyboard.name, keyboard.displayed_layout))
+        # not self.current_keyboard, which prewarm points at the keyboard it's rendering in the background
+        shown_keyboard = self.keyboards[self.keyboard_index]
+        for (name, layout), pooled_keyboard in list(self.pooled_layouts.items()):
+            if len(self.pooled_layouts) <= max(self.layout_pool_size, 1):
+                break
+            if pooled_keyboard is shown_keyboard and layout == pooled_keyboard.displayed_layout:
+                continue  # never drop the keys that are on screen right now
+            del self.pooled_layouts[(name, layout)]
+            pooled_keyboard.drop_layout(layout)
+
+    def get_keyboard(self, name: str = '') -> tuple[int, Optional['Keyboard']]:
+        index = self.keyboard_dict.get(name, -1)
+        return (index, self.load_keyboard(index)) if index != -1 else (-1, None)
+
+    def get_executor(self) -> Optional[ThreadPoolExecutor]:
+        """
+        Get the thread pool used for decoding and resizing key assets, creating it if needed.
+
+        :return: The thread pool, or None if assets should be decoded on the main thread (``decode_threads = 0``,
+                 or only one CPU core to decode on, where threads would only add overhead).
+        """
+        threads = min(self.decode_threads, os.cpu_count() or 1)
+        if threads <= 1:
+            return None
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(threads, thread_name_prefix='decode')
+        return self.executor
+
+    @staticmethod
+    def get_encoder(name: str) -> EncoderProfile:
+        if name not in ENCODER_PROFILES:
+            print(f'Unknown encoder profile "{name}", using "png" instead. '
+                  f'Available profiles: {", ".join(ENCODER_PROFILES)}')
+            name = 'png'
+        return ENCODER_PROFILES[name]
+
+    def get_clipboard_encoder(self, mode: OutputMode) -> EncoderProfile:
+        """
+        Get the encoder profile for copying the file of an output mode to the clipboard.
+
+        :param mode: The output mode.
+        :return: The ``clipboard_encoder`` profile if it's set, otherwise the file's own profile if it's PNG,
+                 and ``png`` for other formats, since most programs can't paste them.
+        """
+        if self.clipboard_encoder is not None:
+            return self.clipboard_encoder
+        if self.encoders[mode].image_format == 'PNG':
+            return self.encoders[mode]
+        return ENCODER_PROFILES['png']
+
+    def get_output_path(self, mode: OutputMode) -> str:
+        return f'image_{mode.value}.{self.encoders[mode].extension}'
+
+    def get_asset_folder(self, name: str) -> Optional[str]:
+        """
+        Get the asset folder of a keyboard without creating it.
+
+        :param name: The keyboard name.
+        :return: The asset folder, or None if there's no keyboard with that name.
+        """
+        if name not in self.keyboard_dict:
+            return None
+        return getattr(self.keyboard_modules[name], 'asset_folder', name)
 
     def run(self):
         director.run(Scene(self))
+        output_writer.flush()  # don't lose the last image when the window is closed
+        pyperclip.disable_helper()  # hands the text over to a clipboard program that outlives the keyboard
 
     def clear_edits(self):
-        for keyboard in self.keyboards:
-            edit_path = f'keyboards/{keyboard.name}_edit.py'
+        for name in self.load_order:
+            edit_path = f'keyboards/{name}_edit.py'
             if os.path.isfile(edit_path):
                 os.remove(edit_path)
 
@@ -243,7 +417,7 @@ class KeyboardManager(CocosNode):
         old_index = self.keyboard_index
         self.remove(self.keyboards[self.keyboard_index])
         self.keyboard_index = index
-        self.current_keyboard = self.keyboards[self.keyboard_index]
+        self.current_keyboard = self.load_keyboard(self.keyboard_index)
         self.add(self.current_keyboard)
 
         self.current_keyboard.update_layout()
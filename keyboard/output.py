@@ -0,0 +1,263 @@
+import os
+from abc import ABC, abstractmethod
+from functools import partial
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+from threading import Condition, Lock, Thread
+from time import perf_counter
+from traceback import print_exc
+from typing import Callable, Optional, Union
+
+from PIL import Image
+
+
+class EncoderProfile:
+    """
+    A way to encode the output images: an image format and its encoder settings.
+
+    Every profile keeps track of how long encoding takes and how large the result is, see ``stats``.
+    """
+
+    def __init__(self, name: str, image_format: str, extension: str, mime_type: str, **options) -> None:
+        """
+        Creates an encoder profile.
+
+        :param name: The profile name, as used in the configuration file.
+        :param image_format: The PIL image format.
+        :param extension: The file extension, without the dot.
+        :param mime_type: The MIME type, which is also the name of the clipboard format.
+        :param options: Encoder options for ``Image.save``.
+        """
+        self.name = name
+        self.image_format = image_format
+        self.extension = extension
+        self.mime_type = mime_type
+        self.options = options
+        self.lock = Lock()
+        self.encodes = 0
+        self.total_time = 0.0
+        self.total_size = 0
+        self.last_time = 0.0
+        self.last_size = 0
+
+    def encode(self, image: Image.Image) -> memoryview:
+        """
+        Encodes an image.
+
+        :param image: The image.
+        :return: The encoded image, as a view of the encoder's buffer so that it's never copied.
+        """
+        start = perf_counter()
+        data_buffer = BytesIO()
+        image.save(data_buffer, format=self.image_format, **self.options)
+        data = data_buffer.getbuffer()
+        elapsed = perf_counter() - start
+        with self.lock:
+            self.encodes += 1
+            self.total_time += elapsed
+            self.total_size += len(data)
+            self.last_time, self.last_size = elapsed, len(data)
+        return data
+
+    def stats(self) -> dict[str, Union[int, float]]:
+        """
+        Get the encoding statistics, e.g. for choosing a profile.
+
+        :return: A dictionary of encode count, total and last encoding time in seconds,
+                 and total and last output size in bytes.
+        """
+        with self.lock:
+            return {
+                'encodes': self.encodes,
+                'total_time': self.total_time,
+                'total_size': self.total_size,
+                'last_time': self.last_time,
+                'last_size': self.last_size,
+            }
+
+
+"""The available encoder profiles, by name."""
+ENCODER_PROFILES = {profile.name: profile for profile in (
+    EncoderProfile('png', 'PNG', 'png', 'image/png'),  # Pillow's defaults
+    EncoderProfile('fast_png', 'PNG', 'png', 'image/png', compress_level=1, optimize=False),
+    EncoderProfile('webp', 'WEBP', 'webp', 'image/webp', lossless=True, quality=0, method=0),
+    EncoderProfile('tga', 'TGA', 'tga', 'image/x-tga', compression=None),  # uncompressed, for local pipelines
+)}
+
+
+class CoalescingWorker(ABC):
+    """
+    Runs tasks on a background thread, one at a time. Tasks submitted while another one is running are merged
+    into a single pending task (by default, the latest one wins), so bursts of updates don't pile up.
+
+    Subclasses implement ``process``, which runs the tasks.
+    """
+
+    name = 'worker'
+
+    def __init__(self) -> None:
+        self.condition = Condition()
+        self.pending = None  # the task waiting to be run
+        self.busy = False
+        self.generation = 0  # increased whenever the pending task replaces the older ones (see ``is_current``)
+        self.task_generation = 0  # the generation of the running task
+        self.thread = None
+
+    def merge(self, pending, task):
+        """
+        Combines the pending task with a newly submitted one.
+
+        :param pending: The task that's still waiting.
+        :param task: The new task.
+        :return: The task to run instead of both.
+        """
+        return task
+
+    @abstractmethod
+    def process(self, task) -> None:
+        """
+        Runs a task. Called on the worker's thread, see ``task_generation`` for the generation of the task.
+
+        :param task: The task.
+        """
+
+    def submit(self, task, replace: bool = True, is_valid: Optional[Callable[[], bool]] = None) -> bool:
+        """
+        Schedules a task to be run.
+
+        :param task: The task.
+        :param replace: Whether the task replaces the running one, making ``is_current`` False for it.
+        :param is_valid: A function that's called under the worker's lock to check whether the task is still
+                         wanted; if it returns False, the task is dropped. Default: always schedule the task.
+        :return: True if the task was scheduled, False if it was dropped.
+        """
+        with self.condition:
+            if is_valid is not None and not is_valid():
+                return False
+            if self.pending is not None:
+                task = self.merge(self.pending, task)
+            if replace:
+                self.generation += 1
+            self.pending = task
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name=self.name, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+        return True
+
+    def cancel(self) -> None:
+        """
+        Drops the pending task, and makes sure that ``is_current`` is False for the running one.
+        """
+        with self.condition:
+            self.generation += 1
+            self.pending = None
+            self.condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until all submitted tasks are done.
+
+        :param timeout: The maximum time to wait, in seconds. Default: wait as long as needed.
+        :return: True if everything was done, False if the timeout ran out first.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.pending is None and not self.busy, timeout)
+
+    def is_current(self, generation: int) -> bool:
+        return generation == self.generation
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None)
+                task, self.pending = self.pending, None
+                self.task_generation = self.generation
+                self.busy = True
+            try:
+                self.process(task)
+            except Exception:
+                print_exc()
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+
+class FileSink:
+    """
+    Writes encoded output files atomically: to a temporary file first, which is then renamed,
+    so other programs never see a half-written file.
+    """
+
+    @staticmethod
+    def send(path: str, data: memoryview) -> None:
+        with NamedTemporaryFile('wb', dir=os.path.dirname(os.path.abspath(path)), prefix=f'{os.path.basename(path)}.',
+                                suffix='.tmp', delete=False) as file:
+            file.write(data)
+        try:
+            os.replace(file.name, path)
+        except OSError:
+            os.remove(file.name)
+            raise
+
+
+class OutputWriter(CoalescingWorker):
+    """
+    Encodes and writes the output images on a background thread, so that typing doesn't wait for image encoding.
+
+    You should not directly instantiate the class, instead you do::
+
+        from keyboard.output import output_writer
+
+    to access the writer shared by all keyboards.
+
+    Only the latest submitted image for every file matters: if new images are submitted while the writer is busy,
+    they replace the images for the same files that are still waiting. Every image is encoded once, and the encoded
+    data is shared with the ``FileSink`` and the callback (e.g. for a ``keyboard.clipboard.ClipboardSink``)
+    without being copied.
+    """
+
+    name = 'output'
+
+    def submit(self, images: dict[str, tuple[Image.Image, EncoderProfile]],
+               callback: Optional[Callable[[dict[str, memoryview], Callable[[], bool]], None]] = None) -> None:
+        """
+        Schedules images to be written, replacing any images for the same files that are still waiting.
+
+        :param images: A dictionary of file paths and (image, encoder profile) tuples.
+                       The images must not be modified afterwards.
+        :param callback: A function to call with the encoded file contents once they're written,
+                         unless images with another callback were submitted in the meantime.
+                         Called on the writer thread, with a function that tells whether that's still the case
+                         (e.g. to pass to ``ClipboardSink.send``), since ``cancel`` may be called while
+                         the callback runs. Default: keep the callback of the images still waiting.
+        """
+        # images without a callback shouldn't keep the callback of the images being written from being called
+        super().submit((images, callback), replace=callback is not None)
+
+    def merge(self, pending, task):
+        (pending_images, pending_callback), (images, callback) = pending, task
+        if callback is None:
+            callback = pending_callback
+        return {**pending_images, **images}, callback
+
+    def process(self, task: tuple[dict[str, tuple[Image.Image, EncoderProfile]], Optional[Callable]]) -> None:
+        images, callback = task
+        generation = self.task_generation
+        written = dict()
+        for path, (image, profile) in images.items():
+            try:
+                data = profile.encode(image)
+                FileSink.send(path, data)
+                written[path] = data
+            except Exception:
+                print_exc()
+        with self.condition:
+            current = callback is not None and self.is_current(generation)
+        # outside the lock, so that a slow callback (e.g. encoding for the clipboard) doesn't block submit and cancel
+        if current:
+            callback(written, partial(self.is_current, generation))
+
+
+"""The singleton; check ``keyboard.output.OutputWriter`` for details on usage."""
+output_writer = OutputWriter()
@@ -0,0 +1,164 @@
+"""
+Runs chains of effects with as few passes over the image as possible.
+
+Besides (or instead of) ``process``, an effect module can define ``describe()``, which returns what ``process`` would
+do right now as a list of operations, or None if it can't be described (then ``process`` is called as usual).
+The operations are tuples of a name and its arguments:
+
+- ``('multiply', color)``: multiply the image by a solid (r, g, b) color, like ``effects/overlay.py``.
+- ``('background', color)``: put a solid (r, g, b) background behind the image, like ``effects/background.py``.
+- ``('gradient_multiply', colors, angle)``: multiply the image by ``effects.gradient.gradient_image``.
+- ``('stripe_multiply', colors, angle)``: multiply the image by ``effects.gradient.stripe_image``.
+- ``('gradient_background', colors, angle)``: put a ``gradient_image`` background behind the image.
+
+The operations of consecutive described effects are compiled together: successive solid multiplies become
+a single lookup table pass, and backgrounds behind an image that's already opaque are skipped.
+Effects that can't be described run in between as they are. All of this gives the same pixels as
+running every effect's ``process`` in turn.
+"""
+from functools import lru_cache
+from traceback import print_exc
+from typing import Callable, Optional
+
+from PIL import Image, ImageChops
+
+from effects.gradient import gradient_image, stripe_image
+
+"""A description of what an effect does: a list of operations, see above."""
+Operations = list[tuple]
+
+IDENTITY = tuple(range(256))
+
+"""One lookup table of 256 values per color channel."""
+Tables = tuple[tuple[int, ...], ...]
+
+
+@lru_cache(maxsize=64)
+def multiply_table(color: tuple[int, int, int]) -> Tables:
+    # the same rounding as ImageChops.multiply
+    return tuple(tuple(value * channel // 255 for value in range(256)) for channel in color)
+
+
+@lru_cache(maxsize=64)
+def compose_tables(first: Tables, second: Tables) -> Tables:
+    return tuple(tuple(table2[value] for value in table1) for table1, table2 in zip(first, second))
+
+
+def compile_operations(operations: Operations) -> Operations:
+    """
+    Merges a list of operations into as few passes as possible.
+
+    :param operations: The operations of one or more consecutive effects, in order.
+    :return: The passes: ``('table', tables)`` for a lookup table per color channel, and otherwise the operations
+             as they are.
+    """
+    passes = []
+    opaque = False  # whether the image is known to be opaque by now
+    for operation in operations:
+        name = operation[0]
+        if name == 'multiply':
+            tables = multiply_table(tuple(operation[1][:3]))
+            if len(passes) > 0 and passes[-1][0] == 'table':
+                tables = compose_tables(passes.pop()[1], tables)
+            passes.append(('table', tables))
+        elif name in ('background', 'gradient_background'):
+            if not opaque:  # compositing an opaque image over anything gives the image itself
+                passes.append(operation)
+                opaque = True
+        else:
+            passes.append(operation)  # multiplying by an opaque image keeps the alpha channel as it is
+    return passes
+
+
+def run_pass(image: Image.Image, operation: tuple) -> Image.Image:
+    name = operation[0]
+    if name == 'table':
+        tables = operation[1]
+        return image.point(sum(tables, ()) + IDENTITY * (len(image.getbands()) - 3))
+    if name == 'background':
+        background = Image.new('RGBA', image.size, (*operation[1][:3], 255))
+        background.alpha_composite(image)
+        return background
+    if name == 'gradient_background':
+        background = gradient_image(image.width, image.height, operation[1], operation[2])
+        background.putalpha(255)
+        background.alpha_composite(image)
+        return background
+    if name in ('gradient_multiply', 'stripe_multiply'):
+        render = gradient_image if name == 'gradient_multiply' else stripe_image
+        overlay = render(image.width, image.height, operation[1], operation[2])
+        overlay.putalpha(255)
+        return ImageChops.multiply(image, overlay)
+    raise ValueError(f'Unknown effect operation "{name}"')
+
+
+def run_operations(image: Image.Image, operations: Operations) -> Image.Image:
+    """
+    Compiles and applies a list of operations.
+
+    :param image: An RGBA image.
+    :param operations: The operations.
+    :return: The processed image, or ``image`` itself if there was nothing to do.
+    """
+    for operation in compile_operations(operations):
+        image = run_pass(image, operation)
+    return image
+
+
+def run_pending(image: Image.Image, operations: Operations) -> Image.Image:
+    try:
+        return run_operations(image, operations)
+    except Exception:
+        print_exc()
+        return image
+
+
+def describe(module, image: Optional[Image.Image]) -> Optional[Operations]:
+    """
+    Get the operations an effect module would apply to an image.
+
+    :param module: The effect module, or None if it couldn't be loaded.
+    :param image: The image.
+    :return: The operations, or None if the module's ``process`` has to be called instead.
+    """
+    if module is None:
+        return []
+    if image is None or image.mode != 'RGBA' or not hasattr(module, 'describe'):
+        return None if hasattr(module, 'process') else []
+    return module.describe()
+
+
+def build_pipeline(modules: list) -> Callable[[Optional[Image.Image]], Optional[Image.Image]]:
+    """
+    Creates a function that runs a list of effect modules on an image, fusing the described ones (see above).
+
+    :param modules: The effect modules in order, with None for modules that couldn't be loaded.
+    :return: The function.
+    """
+
+    def pipeline(image: Optional[Image.Image]) -> Optional[Image.Image]:
+        pending = []
+        for module in modules:
+            try:
+                operations = describe(module, image)
+            except Exception:
+                print_exc()
+                operations = None
+            if operations is not None:
+                pending.extend(operations)
+                continue
+            # an effect that can't be described runs on its own, after everything before it
+            if len(pending) > 0:
+                image = run_pending(image, pending)
+                pending = []
+            if image is not None:
+                image.format = 'PNG'
+            try:
+                image = module.process(image)
+            except Exception:
+                print_exc()
+        if len(pending) > 0:
+            image = run_pending(image, pending)
+        return image
+
+    return pipeline
@@ -28,5 +28,5 @@ fixed_layout = True
 
 
 def postprocess(image: Optional[Image.Image]) -> Optional[Image.Image]:
-    manager.keyboard.update_layout()
+    manager.keyboard.update_cells()
     return image
@@ -50,13 +50,22 @@ __version__ = '1.8.2'
 
 import contextlib
 import ctypes
+import importlib.util
+import json
 import os
 import platform
+import queue
+import select
+import signal
+import site
+import struct
 import subprocess
 import sys
+import threading
 import time
 import warnings
 
+from concurrent.futures import ThreadPoolExecutor
 from ctypes import c_size_t, sizeof, c_wchar_p, get_errno, c_wchar
 
 
@@ -523,6 +532,319 @@ def init_wsl_clipboard():
     return copy_wsl, paste_wsl
 
 
+# The clipboard helper protocol: every text is sent as a 4-byte big-endian length followed by
+# the UTF-8 encoded text. The helper answers with HELPER_ACK once it's ready, and again once
+# it owns the clipboard with the new text. See serve_helper() for the default helper.
+HELPER_HEADER = struct.Struct('>I')
+HELPER_ACK = b'\x01'
+HELPER_TIMEOUT = 2.0  # seconds to wait for an answer before giving up on the helper
+
+
+def default_helper_command():
+    # A frozen executable would start the whole application again instead of the helper.
+    if getattr(sys, 'frozen', False):
+        return None
+    return [sys.executable, '-m', 'pyperclip', '--serve']
+
+
+class ClipboardHelper(object):
+    '''
+    A long-lived process that owns the clipboard and is sent new contents over
+    a pipe, so that copying doesn't start a new process every time.
+
+    The helper is started on the first copy and restarted if it exits. If it
+    can't be started or stops answering, the helper is disabled and copy()
+    returns False, so that the caller can fall back to another mechanism.
+    '''
+
+    def __init__(self, command=None):
+        self.command = default_helper_command() if command is None else command
+        self.process = None
+        self.failed = self.command is None
+        self.lock = threading.Lock()
+
+    def _read_ack(self):
+        # select() doesn't work on pipes on Windows, so there the read just blocks.
+        if os.name != 'nt':
+            ready, _, _ = select.select([self.process.stdout], [], [], HELPER_TIMEOUT)
+            if not ready:
+                return False
+        return self.process.stdout.read(1) == HELPER_ACK
+
+    def _start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        bufsize=0, close_fds=True)
+        if not self._read_ack():
+            raise PyperclipException('The clipboard helper %r did not start.' % (self.command,))
+
+    def copy(self, text):
+        '''
+        Sends text to the helper. Returns True if the helper now owns the
+        clipboard with that text, and False if the helper isn't available.
+        '''
+        with self.lock:
+            if self.failed:
+                return False
+            try:
+                if self.process is None or self.process.poll() is not None:
+                    self._start()
+                data = text.encode(ENCODING)
+                frame = memoryview(HELPER_HEADER.pack(len(data)) + data)
+                while len(frame) > 0:
+                    frame = frame[self.process.stdin.write(frame):]
+                if not self._read_ack():
+                    raise PyperclipException('The clipboard helper %r did not answer.' % (self.command,))
+                return True
+            except (OSError, ValueError, PyperclipException) as e:
+                warnings.warn('%s Falling back to the regular clipboard mechanism.' % (e,))
+                self.failed = True
+                self.close()
+                return False
+
+    def close(self):
+        '''
+        Stops the helper. The default helper hands the clipboard over to the
+        regular clipboard mechanism before it exits, so the contents are kept.
+        '''
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        if self.failed and process.poll() is None:
+            process.kill()
+        try:
+            process.wait(HELPER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            pass
+        process.stdout.close()
+
+
+def init_helper_clipboard(command=None):
+    helper = ClipboardHelper(command)
+    fallback = []  # the regular copy() and paste(), determined when they're first needed
+
+    def get_fallback():
+        if not fallback:
+            fallback.extend(determine_clipboard())
+        return fallback
+
+    def copy_helper(text):
+        text = _stringifyText(text) # Converts non-str values to str.
+        if not helper.copy(text):
+            get_fallback()[0](text)
+
+    def paste_helper():
+        return get_fallback()[1]()
+
+    copy_helper.helper = helper
+    return copy_helper, paste_helper
+
+
+def serve_helper():
+    '''
+    Runs the default clipboard helper (see ClipboardHelper): a hidden Tk
+    window that owns the clipboard, reading texts from stdin and answering on
+    stdout. Runs until stdin is closed, then hands the last text over to the
+    regular clipboard mechanism so that it outlives the helper.
+    '''
+    import tkinter
+
+    root = tkinter.Tk()
+    root.withdraw()
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    state = {'text': ''}
+
+    def on_frame(file, mask):
+        header = stdin.read(HELPER_HEADER.size)
+        if len(header) < HELPER_HEADER.size:
+            root.quit()
+            return
+        (length,) = HELPER_HEADER.unpack(header)
+        text = stdin.read(length).decode(ENCODING)
+        root.clipboard_clear()
+        if text:
+            root.clipboard_append(text)
+        root.update()
+        state['text'] = text
+        stdout.write(HELPER_ACK)
+        stdout.flush()
+
+    # Only one frame is sent at a time, so nothing is left in stdin's buffer when the handler returns.
+    root.tk.createfilehandler(stdin, tkinter.READABLE, on_frame)
+    stdout.write(HELPER_ACK)
+    stdout.flush()
+    root.mainloop()
+    root.tk.deletefilehandler(stdin)
+    root.destroy()
+    if state['text']:
+        determine_clipboard()[0](state['text'])
+
+
+CLIPBOARD_TYPES = {
+    "pbcopy": init_osx_pbcopy_clipboard,
+    "pyobjc": init_osx_pyobjc_clipboard,
+    "gtk": init_gtk_clipboard,
+    "qt": init_qt_clipboard,  # TODO - split this into 'qtpy', 'pyqt4', and 'pyqt5'
+    "xclip": init_xclip_clipboard,
+    "xsel": init_xsel_clipboard,
+    "wl-clipboard": init_wl_clipboard,
+    "klipper": init_klipper_clipboard,
+    "windows": init_windows_clipboard,
+    "no": init_no_clipboard,
+}
+
+# The programs the Linux backends need, in the order they're preferred in.
+PROBE_EXECUTABLES = ('wl-copy', 'xsel', 'xclip', 'klipper', 'qdbus')
+
+
+def _default_probe_cache_path():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'pyperclip', 'backend.json')
+
+
+# Where probe_clipboard() keeps its result between runs, or None to probe every time.
+PROBE_CACHE_PATH = _default_probe_cache_path()
+
+_probe_lock = threading.Lock()
+_probe_result = []  # the backend found by probe_clipboard() in this process
+_probe_thread = None
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _get_package_folders():
+    try:
+        return site.getsitepackages() + [site.getusersitepackages()]
+    except AttributeError:  # old virtualenvs replace the site module
+        return [folder for folder in sys.path if folder.endswith(('site-packages', 'dist-packages'))]
+
+
+def _probe_signature():
+    # Everything the probe depends on. Installing or removing a program or a
+    # Python package changes the modification time of its folder. (Not all of
+    # sys.path, since the script's own folder may change all the time.)
+    folders = os.environ.get('PATH', '').split(os.pathsep) + _get_package_folders()
+    return {
+        'version': __version__,
+        'python': sys.executable,
+        'DISPLAY': os.environ.get('DISPLAY'),
+        'WAYLAND_DISPLAY': os.environ.get('WAYLAND_DISPLAY'),
+        'folders': [[folder, _get_mtime(folder)] for folder in folders],
+    }
+
+
+def _read_probe_cache(signature):
+    if PROBE_CACHE_PATH is None:
+        return None
+    try:
+        with open(PROBE_CACHE_PATH) as f:
+            cached = json.load(f)
+        if cached['signature'] != signature:
+            return None
+        # programs can also be replaced in place, e.g. by an upgrade
+        for path, mtime in cached['executables'].values():
+            if _get_mtime(path) != mtime:
+                return None
+        return cached['backend']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_probe_cache(signature, backend, executables):
+    if PROBE_CACHE_PATH is None:
+        return
+    cached = {
+        'signature': signature,
+        'backend': backend,
+        'executables': dict((name, [path, _get_mtime(path)]) for name, path in executables.items() if path),
+    }
+    temp_path = '%s.%d.tmp' % (PROBE_CACHE_PATH, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(PROBE_CACHE_PATH)):
+            os.makedirs(os.path.dirname(PROBE_CACHE_PATH))
+        with open(temp_path, 'w') as f:
+            json.dump(cached, f)
+        os.replace(temp_path, PROBE_CACHE_PATH)
+    except OSError:
+        pass  # the cache is only an optimization
+
+
+def _module_exists(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _probe_linux_backend():
+    # The programs are looked for concurrently, and modules are only looked
+    # for, not imported, so that probing has no side effects and can run on
+    # any thread.
+    with ThreadPoolExecutor(len(PROBE_EXECUTABLES)) as pool:
+        executables = dict(zip(PROBE_EXECUTABLES, pool.map(_executable_exists, PROBE_EXECUTABLES)))
+
+    if _module_exists('gtk'):
+        backend = 'gtk'
+    elif os.environ.get("WAYLAND_DISPLAY") and executables['wl-copy']:
+        backend = 'wl-clipboard'
+    elif executables['xsel']:
+        backend = 'xsel'
+    elif executables['xclip']:
+        backend = 'xclip'
+    elif executables['klipper'] and executables['qdbus']:
+        backend = 'klipper'
+    elif _module_exists('qtpy') or _module_exists('PyQt5') or _module_exists('PyQt4'):
+        backend = 'qt'
+    else:
+        backend = 'no'
+    return backend, executables
+
+
+def probe_clipboard():
+    '''
+    Find the clipboard backend to use on Linux, as a set_clipboard() name.
+
+    The result is kept for the rest of the process and cached in
+    PROBE_CACHE_PATH, so that later runs only have to check that nothing
+    changed (see _probe_signature). Thread-safe; if a probe is already
+    running, e.g. from probe_clipboard_in_background(), waits for it.
+    '''
+    with _probe_lock:
+        if not _probe_result:
+            signature = _probe_signature()
+            backend = _read_probe_cache(signature)
+            if backend not in CLIPBOARD_TYPES:
+                backend, executables = _probe_linux_backend()
+                _write_probe_cache(signature, backend, executables)
+            _probe_result.append(backend)
+        return _probe_result[0]
+
+
+def probe_clipboard_in_background():
+    '''
+    Starts probe_clipboard() on a background thread, so that the first copy()
+    or paste() doesn't have to wait for it. Does nothing if the backend
+    doesn't need probing.
+    '''
+    global _probe_thread
+
+    if _probe_thread is not None or _probe_result or not HAS_DISPLAY:
+        return
+    if os.name == 'nt' or platform.system() in ('Windows', 'Darwin'):
+        return
+    _probe_thread = threading.Thread(target=probe_clipboard, name='pyperclip-probe')
+    _probe_thread.daemon = True
+    _probe_thread.start()
+
+
 # Automatic detection of clipboard mechanisms and importing is done in deteremine_clipboard():
 def determine_clipboard():
     '''
@@ -561,45 +883,7 @@ def determine_clipboard():
 
     # Setup for the LINUX platform:
     if HAS_DISPLAY:
-        try:
-            import gtk  # check if gtk is installed
-        except ImportError:
-            pass # We want to fail fast for all non-ImportError exceptions.
-        else:
-            return init_gtk_clipboard()
-
-        if (
-                os.environ.get("WAYLAND_DISPLAY") and
-                _executable_exists("wl-copy")
-        ):
-            return init_wl_clipboard()
-        if _executable_exists("xsel"):
-            return init_xsel_clipboard()
-        if _executable_exists("xclip"):
-            return init_xclip_clipboard()
-        if _executable_exists("klipper") and _executable_exists("qdbus"):
-            return init_klipper_clipboard()
-
-        try:
-            # qtpy is a small abstraction layer that lets you write applications using a single api call to either PyQt or PySide.
-            # https://pypi.python.org/pypi/QtPy
-            import qtpy  # check if qtpy is installed
-        except ImportError:
-            # If qtpy isn't installed, fall back on importing PyQt4.
-            try:
-                import PyQt5  # check if PyQt5 is installed
-            except ImportError:
-                try:
-                    import PyQt4  # check if PyQt4 is installed
-                except ImportError:
-                    pass # We want to fail fast for all non-ImportError exceptions.
-                else:
-                    return init_qt_clipboard()
-            else:
-                return init_qt_clipboard()
-        else:
-            return init_qt_clipboard()
-
+        return CLIPBOARD_TYPES[probe_clipboard()]()
 
     return init_no_clipboard()
 
@@ -621,24 +905,44 @@ def set_clipboard(clipboard):
     '''
     global copy, paste
 
-    clipboard_types = {
-        "pbcopy": init_osx_pbcopy_clipboard,
-        "pyobjc": init_osx_pyobjc_clipboard,
-        "gtk": init_gtk_clipboard,
-        "qt": init_qt_clipboard,  # TODO - split this into 'qtpy', 'pyqt4', and 'pyqt5'
-        "xclip": init_xclip_clipboard,
-        "xsel": init_xsel_clipboard,
-        "wl-clipboard": init_wl_clipboard,
-        "klipper": init_klipper_clipboard,
-        "windows": init_windows_clipboard,
-        "no": init_no_clipboard,
-    }
-
-    if clipboard not in clipboard_types:
-        raise ValueError('Argument must be one of %s' % (', '.join([repr(_) for _ in clipboard_types.keys()])))
+    if clipboard not in CLIPBOARD_TYPES:
+        raise ValueError('Argument must be one of %s' % (', '.join([repr(_) for _ in CLIPBOARD_TYPES.keys()])))
 
     # Sets pyperclip's copy() and paste() functions:
-    copy, paste = clipboard_types[clipboard]()
+    copy, paste = CLIPBOARD_TYPES[clipboard]()
+
+
+def enable_helper(command=None):
+    '''
+    Makes copy() send the text to a long-lived clipboard helper process (see
+    ClipboardHelper) instead of running a clipboard program for every call.
+    Copies fall back to the regular clipboard mechanism if the helper isn't
+    available. The command defaults to the helper in this module, which
+    needs tkinter.
+    '''
+    global copy, paste
+
+    if is_helper_enabled():
+        if command is None or command == copy.helper.command:
+            return
+        disable_helper()
+    copy, paste = init_helper_clipboard(command)
+
+
+def disable_helper():
+    '''
+    Stops the clipboard helper started by enable_helper(), if there is one,
+    and goes back to the regular clipboard mechanism.
+    '''
+    global copy, paste
+
+    if is_helper_enabled():
+        copy.helper.close()
+        copy, paste = lazy_load_stub_copy, lazy_load_stub_paste
+
+
+def is_helper_enabled():
+    return hasattr(copy, 'helper')
 
 
 def lazy_load_stub_copy(text):
@@ -696,6 +1000,193 @@ copy, paste = lazy_load_stub_copy, lazy_load_stub_paste
 
 
 
+# How often ClipboardWatcher polls if there's no way to be notified of changes:
+# every WATCH_MIN_INTERVAL seconds after a change, backing off to WATCH_MAX_INTERVAL.
+WATCH_MIN_INTERVAL = 0.01
+WATCH_MAX_INTERVAL = 1.0
+
+
+def default_notifier_command():
+    '''
+    Get a command that prints a line whenever the clipboard changes, or None
+    if there's none on this system. Uses wl-paste --watch on Wayland and
+    clipnotify on X11.
+    '''
+    if os.environ.get("WAYLAND_DISPLAY") and _executable_exists("wl-paste"):
+        return ['wl-paste', '--watch', 'echo']
+    if HAS_DISPLAY and _executable_exists("clipnotify"):
+        # clipnotify exits on the next change, so this runs it once per change
+        return ['sh', '-c', 'while clipnotify; do echo; done']
+    return None
+
+
+def _start_notifier(command):
+    # In a session of its own on POSIX, so that _stop_notifier() also stops
+    # whatever the command starts: clipnotify under sh would otherwise keep
+    # stdout open, and reading it would block until the next change.
+    return subprocess.Popen(command, stdout=subprocess.PIPE, close_fds=True,
+                            start_new_session=os.name == 'posix')
+
+
+def _stop_notifier(process):
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:  # everything in the session has exited already
+            pass
+    elif process.poll() is None:
+        process.kill()
+
+
+def _get_change_counter():
+    # A function that cheaply tells whether the clipboard may have changed,
+    # so that polling doesn't have to read the clipboard every time.
+    if os.name == 'nt' or platform.system() == 'Windows':
+        return ctypes.windll.user32.GetClipboardSequenceNumber
+    return None
+
+
+class ClipboardWatcher(object):
+    '''
+    Watches the clipboard for new text on a background thread.
+
+    New texts are passed to the callback (called on the watcher thread) or,
+    without a callback, can be iterated over:
+
+        with pyperclip.ClipboardWatcher() as watcher:
+            for text in watcher:
+                print(text)
+
+    The watcher waits for a notifier command (see default_notifier_command)
+    to print a line, and only then reads the clipboard with paste(). Without
+    a notifier, or if it exits, the clipboard is polled instead, backing off
+    from WATCH_MIN_INTERVAL to WATCH_MAX_INTERVAL while nothing changes.
+    '''
+
+    def __init__(self, callback=None, notifier=None, paste_func=None,
+                 min_interval=WATCH_MIN_INTERVAL, max_interval=WATCH_MAX_INTERVAL):
+        '''
+        callback: Called with every new text. Default: queue them for iteration and get().
+        notifier: The notifier command. Default: default_notifier_command().
+                  An empty list always polls.
+        paste_func: Reads the clipboard. Default: paste().
+        '''
+        self.callback = callback
+        self.notifier = default_notifier_command() if notifier is None else notifier
+        self.paste_func = paste_func
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.texts = queue.Queue()
+        self.stopped = threading.Event()
+        self.process = None
+        self.thread = None
+        self.last = None
+        self.mode = None  # 'notifier' or 'polling', once started
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __iter__(self):
+        while True:
+            text = self.get()
+            if text is None:
+                return
+            yield text
+
+    def start(self):
+        '''
+        Starts watching. Texts that are on the clipboard already don't count as new.
+        '''
+        if self.thread is not None:
+            return
+        self.last = self._paste()
+        self.thread = threading.Thread(target=self._run, name='pyperclip-watcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        process = self.process
+        if process is not None and process.returncode is None:  # not reaped by _watch() yet
+            _stop_notifier(process)
+        self.texts.put(None)  # wakes up get()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def get(self, timeout=None):
+        '''
+        Waits for the next new text, if there's no callback.
+        Returns None once the watcher is stopped, and raises
+        PyperclipTimeoutException if the timeout runs out first.
+        '''
+        try:
+            text = self.texts.get(timeout=timeout)
+        except queue.Empty:
+            raise PyperclipTimeoutException('No new text within ' + str(timeout) + ' seconds.')
+        if text is None:
+            self.texts.put(None)  # for any other waiting threads
+        return text
+
+    def _paste(self):
+        return paste() if self.paste_func is None else self.paste_func()
+
+    def _check(self):
+        text = self._paste()
+        if text == self.last or self.stopped.is_set():
+            return False
+        self.last = text
+        if self.callback is not None:
+            self.callback(text)
+        else:
+            self.texts.put(text)
+        return True
+
+    def _run(self):
+        if self.notifier:
+            self.mode = 'notifier'
+            try:
+                self._watch()
+            except OSError:
+                pass
+        if not self.stopped.is_set():
+            self.mode = 'polling'
+            self._poll()
+
+    def _watch(self):
+        self.process = _start_notifier(self.notifier)
+        if self.stopped.is_set():  # stop() may have missed the process
+            _stop_notifier(self.process)
+        try:
+            for _ in iter(self.process.stdout.readline, b''):
+                if self.stopped.is_set():
+                    break
+                self._check()
+        finally:
+            _stop_notifier(self.process)
+            self.process.wait()
+            self.process.stdout.close()
+
+    def _poll(self):
+        counter = _get_change_counter()
+        count = counter() if counter is not None else None
+        interval = self.min_interval
+        while not self.stopped.wait(interval):
+            if counter is not None:
+                new_count = counter()
+                if new_count == count:
+                    interval = min(interval * 2, self.max_interval)
+                    continue
+                count = new_count
+            if self._check():
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+
+
 def waitForPaste(timeout=None):
     """This function call blocks until a non-empty text string exists on the
     clipboard. It returns this text.
@@ -703,15 +1194,19 @@ def waitForPaste(timeout=None):
     This function raises PyperclipTimeoutException if timeout was set to
     a number of seconds that has elapsed without non-empty text being put on
     the clipboard."""
-    startTime = time.time()
-    while True:
-        clipboardText = paste()
-        if clipboardText != '':
-            return clipboardText
-        time.sleep(0.01)
-
-        if timeout is not None and time.time() > startTime + timeout:
-            raise PyperclipTimeoutException('waitForPaste() timed out after ' + str(timeout) + ' seconds.')
+    endTime = None if timeout is None else time.time() + timeout
+    with ClipboardWatcher() as watcher:
+        # the watcher is started first, so that text copied right after this check is still reported as new
+        if watcher.last != '':
+            return watcher.last
+        while True:
+            remaining = None if endTime is None else max(endTime - time.time(), 0)
+            try:
+                clipboardText = watcher.get(remaining)
+            except PyperclipTimeoutException:
+                raise PyperclipTimeoutException('waitForPaste() timed out after ' + str(timeout) + ' seconds.')
+            if clipboardText != '':
+                return clipboardText
 
 
 def waitForNewPaste(timeout=None):
@@ -722,18 +1217,15 @@ def waitForNewPaste(timeout=None):
     This function raises PyperclipTimeoutException if timeout was set to
     a number of seconds that has elapsed without non-empty text being put on
     the clipboard."""
-    startTime = time.time()
-    originalText = paste()
-    while True:
-        currentText = paste()
-        if currentText != originalText:
-            return currentText
-        time.sleep(0.01)
-
-        if timeout is not None and time.time() > startTime + timeout:
+    with ClipboardWatcher() as watcher:
+        try:
+            return watcher.get(timeout)
+        except PyperclipTimeoutException:
             raise PyperclipTimeoutException('waitForNewPaste() timed out after ' + str(timeout) + ' seconds.')
 
 
-__all__ = ['copy', 'paste', 'waitForPaste', 'waitForNewPaste', 'set_clipboard', 'determine_clipboard']
+__all__ = ['copy', 'paste', 'waitForPaste', 'waitForNewPaste', 'set_clipboard', 'determine_clipboard',
+           'enable_helper', 'disable_helper', 'probe_clipboard', 'probe_clipboard_in_background',
+           'ClipboardWatcher']
 
 
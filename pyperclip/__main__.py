@@ -8,6 +8,8 @@ if len(sys.argv) > 1 and sys.argv[1] in ('-c', '--copy'):
         pyperclip.copy(sys.stdin.read())
 elif len(sys.argv) > 1 and sys.argv[1] in ('-p', '--paste'):
     sys.stdout.write(pyperclip.paste())
+elif len(sys.argv) > 1 and sys.argv[1] == '--serve':
+    pyperclip.serve_helper()
 else:
     print('Usage: python -m pyperclip [-c | --copy] [text_to_copy] | [-p | --paste]')
     print()
@@ -15,4 +17,7 @@ else:
     print('clipboard. Otherwise, the stdin stream is copied to the')
     print('clipboard. (If reading this in from the keyboard, press')
     print('CTRL-Z on Windows or CTRL-D on Linux/macOS to stop.')
-    print('When pasting, the clipboard will be written to stdout.')
\ No newline at end of file
+    print('When pasting, the clipboard will be written to stdout.')
+    print()
+    print('python -m pyperclip --serve runs the clipboard helper used by')
+    print('pyperclip.enable_helper(), which reads texts from stdin.')
\ No newline at end of file
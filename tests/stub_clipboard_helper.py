@@ -0,0 +1,51 @@
+"""
+A stand-in for ``python -m pyperclip --serve`` that needs no display, for testing ``pyperclip.ClipboardHelper``.
+
+Usage::
+
+    python tests/stub_clipboard_helper.py <mode> <log file>
+
+Reads length-prefixed frames from stdin like ``pyperclip.serve_helper`` and writes the received texts to the log file,
+one JSON string per line, once stdin is closed. The mode picks how it answers:
+
+- ``serve``: acknowledges every frame.
+- ``hang``: starts up, but never acknowledges a frame.
+- ``die``: starts up, and exits as soon as it gets a frame.
+"""
+import json
+import struct
+import sys
+import time
+
+ACK = b'\x01'
+HEADER = struct.Struct('>I')
+
+
+def main() -> None:
+    mode, log_path = sys.argv[1], sys.argv[2]
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    texts = []
+    stdout.write(ACK)  # started
+    stdout.flush()
+    while True:
+        header = stdin.read(HEADER.size)
+        if len(header) < HEADER.size:
+            break
+        (length,) = HEADER.unpack(header)
+        data = stdin.read(length)
+        if len(data) != length:
+            raise ValueError(f'expected {length} bytes, got {len(data)}')
+        if mode == 'die':
+            sys.exit(1)
+        texts.append(data.decode('utf-8'))
+        if mode == 'hang':
+            time.sleep(60)
+        stdout.write(ACK)
+        stdout.flush()
+    with open(log_path, 'w', encoding='utf-8') as file:
+        for text in texts:
+            file.write(json.dumps(text) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+import warnings
+
+import pyperclip
+
+STUB_HELPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_clipboard_helper.py')
+
+
+@unittest.skipIf(os.name == 'nt', 'the helper answers are read with select()')
+class TestClipboardHelper(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.log_path = os.path.join(folder.name, 'texts.jsonl')
+
+    def get_helper(self, mode):
+        helper = pyperclip.ClipboardHelper([sys.executable, STUB_HELPER, mode, self.log_path])
+        self.addCleanup(helper.close)
+        return helper
+
+    def read_log(self):
+        with open(self.log_path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_framing(self):
+        texts = ['hello', '', 'ключ 🔑', 'x' * 100000]
+        helper = self.get_helper('serve')
+        for text in texts:
+            self.assertTrue(helper.copy(text))
+        helper.close()
+        self.assertEqual(self.read_log(), texts)
+
+    def test_timeout(self):
+        helper = self.get_helper('hang')
+        start = time.time()
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            self.assertFalse(helper.copy('hello'))
+        self.assertGreaterEqual(time.time() - start, pyperclip.HELPER_TIMEOUT - 0.1)
+        self.assertLess(time.time() - start, pyperclip.HELPER_TIMEOUT + 2)
+        self.assertTrue(helper.failed)
+        self.assertFalse(helper.copy('again'))  # stays disabled instead of waiting again
+
+    def test_helper_dies(self):
+        helper = self.get_helper('die')
+        start = time.time()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertFalse(helper.copy('hello'))
+        self.assertLess(time.time() - start, pyperclip.HELPER_TIMEOUT + 2)
+        self.assertEqual(len(caught), 1)
+
+    def test_fallback(self):
+        copied = []
+        determine_clipboard = pyperclip.determine_clipboard
+        pyperclip.determine_clipboard = lambda: (copied.append, lambda: copied[-1])
+        self.addCleanup(setattr, pyperclip, 'determine_clipboard', determine_clipboard)
+        copy, paste = pyperclip.init_helper_clipboard([sys.executable, STUB_HELPER, 'die', self.log_path])
+        self.addCleanup(copy.helper.close)
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            copy('hello')
+        self.assertEqual(copied, ['hello'])
+        self.assertEqual(paste(), 'hello')
+
+
+if __name__ == '__main__':
+    unittest.main()
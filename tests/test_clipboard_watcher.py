@@ -0,0 +1,40 @@
+import os
+import time
+import unittest
+
+import pyperclip
+
+# stands in for `sh -c 'while clipnotify; do echo; done'`: a shell whose child keeps stdout open
+STUB_NOTIFIER = ['sh', '-c', 'while sleep 3; do echo; done']
+
+
+@unittest.skipUnless(os.name == 'posix', 'the notifier is a shell script')
+class TestClipboardWatcher(unittest.TestCase):
+    def test_stop_kills_notifier_children(self):
+        watcher = pyperclip.ClipboardWatcher(notifier=STUB_NOTIFIER, paste_func=lambda: '')
+        watcher.start()
+        deadline = time.time() + 2
+        while watcher.process is None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(watcher.mode, 'notifier')
+        time.sleep(0.1)  # let the shell start its child
+        start = time.time()
+        watcher.stop()
+        self.assertLess(time.time() - start, 1)
+        self.assertFalse(watcher.thread.is_alive())
+
+    def test_polling_reports_new_text(self):
+        texts = iter(['old', 'old', 'new'])
+
+        def paste_func():
+            return next(texts, 'new')
+
+        watcher = pyperclip.ClipboardWatcher(notifier=[], paste_func=paste_func, min_interval=0.01)
+        start = time.time()
+        with watcher:
+            self.assertEqual(watcher.get(2), 'new')
+        self.assertLess(time.time() - start, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()